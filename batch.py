@@ -0,0 +1,243 @@
+################################################################################
+# TRAVELING SALESMAN PROBLEM - BATCH RUNNER
+# Olga Koldachenko          okold525@mtroyal.ca
+# COMP 5690                 Senior Computer Science Project
+# Mount Royal University    Winter 2022
+#
+# Runs a sweep of experiments, each a run of stake.py, as many at a time as
+# there are cores for. Every run gets its own port and log directory, so they
+# don't get in each other's way. Running:
+#   python batch.py comp coop selfish selfless --seeds 1 2 3
+# runs each of the four server configs with seeds 1, 2 and 3, like the study in
+# results/, saving the logs to logs/batch-<time>/<config>-<client config>-<seed>.
+# --client-configs runs each server config with each of the given client
+# configs instead of its own. Run it with --help for the other options.
+#
+# Each run takes a core per local stakeholder (its client config's rows times
+# the pop_multiplier), since the GAs run through the whole round while the
+# server mostly waits. Runs are started in order whenever their cores are free,
+# out of --cores (default all of them), a run that needs more than that being
+# started on its own. Configs with remote_clients aren't supported, since
+# nothing would start the remote stakeholders.
+#
+# Once every run is done, a row for each is written to Summary.csv in the batch
+# directory, and the runs of each pair of configs are averaged over the seeds.
+#
+#       Experiment(server_config, client_config, seed, log_dir)
+# A single run of stake.py, with the server config's name (without .csv), the
+# client config (None for the server config's own) and seed (None for none).
+#
+# METHODS
+# cores()             - returns how many cores it takes
+# start(port)         - starts stake.py on the given port, its output going to
+#                       Output.txt in its log directory
+# poll()              - returns its exit code, or None if it's still running
+# summary()           - returns a dict of its settings and results
+#
+#
+#       summarize(log_dir)
+# Returns a dict of the results in a run's Server.csv: the number of rounds, the
+# best chair fitness of any round, the last round's best fitness and who found
+# it, and the mean of every stakeholder's last fitness. The values are None if
+# there's no Server.csv.
+#
+#       run_batch(experiments, cores, port)
+# Runs the experiments, at most cores' worth at a time, giving them ports from
+# port up, and returns them once they're all done.
+from datetime import datetime as dt
+import subprocess
+import argparse
+import socket
+import pandas
+import client
+import time
+import sys
+import os
+
+POLL_INTERVAL = 1       # seconds between checks on the running experiments
+
+class Experiment():
+    def __init__(self, server_config, client_config = None, seed = None, log_dir = None):
+        self.server_config = server_config
+        self.client_config = client_config
+        self.seed = seed
+        self.log_dir = log_dir
+        self.port = None
+        self.process = None
+        self.output = None
+        self.start_time = None
+        self.seconds = None
+
+    # one core per local stakeholder, the same way stake.py counts them
+    def cores(self):
+        config = pandas.read_csv(os.path.join("server_configs", self.server_config + ".csv"))
+        if not bool(client.option(config, 0, "local_clients", True)):
+            return 1
+
+        client_config = self.client_config
+        if client_config is None:
+            client_config = client.option(config, 0, "client_config", "default.csv")
+        pop_multiplier = int(client.option(config, 0, "pop_multiplier", 1))
+        stakeholders = len(pandas.read_csv(os.path.join("client_configs", client_config)))
+        return max(stakeholders * pop_multiplier, 1)
+
+    def start(self, port):
+        self.port = port
+        os.makedirs(self.log_dir, exist_ok=True)
+
+        args = [sys.executable, "stake.py", self.server_config, "--port", str(port), "--log-dir", self.log_dir]
+        if self.client_config is not None:
+            args += ["--client-config", self.client_config]
+        if self.seed is not None:
+            args += ["--seed", str(self.seed)]
+
+        # the solution is only saved, never shown
+        args.append("--headless")
+        self.output = open(os.path.join(self.log_dir, "Output.txt"), "w")
+        self.start_time = time.time()
+        self.process = subprocess.Popen(args, stdout=self.output, stderr=subprocess.STDOUT)
+
+    def poll(self):
+        code = self.process.poll()
+        if code is not None and self.seconds is None:
+            self.seconds = time.time() - self.start_time
+            self.output.close()
+        return code
+
+    def summary(self):
+        values = {"Server Config": self.server_config,
+                  "Client Config": self.client_config,
+                  "Seed": self.seed,
+                  "Port": self.port,
+                  "Exit Code": None if self.process is None else self.process.returncode,
+                  "Seconds": self.seconds,
+                  "Log Dir": self.log_dir}
+        values.update(summarize(self.log_dir))
+        return values
+
+    def __str__(self):
+        return "{} ({}, seed {})".format(self.server_config, self.client_config or "own client config", self.seed)
+
+def summarize(log_dir):
+    summary = {"Rounds": None, "Best Fitness": None, "Final Fitness": None, "Final Stakeholder": None, "Mean Final Fitness": None}
+
+    path = os.path.join(log_dir, "Server.csv")
+    if not os.path.exists(path) and os.path.exists(path + ".gz"):
+        path += ".gz"
+    try:
+        csv = pandas.read_csv(path)
+    except (FileNotFoundError, pandas.errors.EmptyDataError):
+        return summary
+    if len(csv) == 0:
+        return summary
+
+    # the stakeholders' fitness columns are the ones with a generations column,
+    # or every column after the best solution in older logs without them
+    columns = list(csv.columns[4:])
+    stakeholders = [c for c in columns if "{} generations".format(c) in columns]
+    if stakeholders == [] and not any(c.endswith(" generations") for c in columns):
+        stakeholders = columns
+
+    last = csv.iloc[-1]
+    summary["Rounds"] = int(last["Round"])
+    summary["Best Fitness"] = csv["Best Solution Fitness"].max()
+    summary["Final Fitness"] = last["Best Solution Fitness"]
+    summary["Final Stakeholder"] = last["Best Solution Stakeholder"]
+    if stakeholders != []:
+        summary["Mean Final Fitness"] = pandas.to_numeric(last[stakeholders], errors="coerce").mean()
+    return summary
+
+# returns the first port from port up that isn't taken, or listened on by
+# something else
+def free_port(port, taken):
+    while True:
+        if port not in taken:
+            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+                try:
+                    s.bind(("localhost", port))
+                    return port
+                except OSError:
+                    pass
+        port += 1
+
+def run_batch(experiments, cores = None, port = 6100):
+    if cores is None:
+        cores = os.cpu_count()
+
+    waiting = [(e, e.cores()) for e in experiments]
+    running = []
+    used = 0
+    next_port = port
+
+    while waiting != [] or running != []:
+        for e, needed in list(running):
+            code = e.poll()
+            if code is not None:
+                running.remove((e, needed))
+                used -= needed
+                print(dt.now(), "Finished {} in {:.0f} seconds, exit code {}.".format(e, e.seconds, code), flush=True)
+
+        # starts experiments in order, while their cores are free
+        while waiting != []:
+            e, needed = waiting[0]
+            if used + needed > cores and running != []:
+                break
+            waiting.pop(0)
+            next_port = free_port(next_port, [r.port for r, n in running])
+            e.start(next_port)
+            next_port += 1
+            running.append((e, needed))
+            used += needed
+            print(dt.now(), "Started {} on port {} with {} cores, logging to {}".format(e, e.port, needed, e.log_dir), flush=True)
+
+        if running != []:
+            time.sleep(POLL_INTERVAL)
+
+    return experiments
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs a sweep of stakeholder searches in parallel.")
+    parser.add_argument("configs", nargs="+", help="server config files in server_configs, without .csv")
+    parser.add_argument("--client-configs", nargs="*", default=None, help="client config files in client_configs to run each server config with, instead of its own")
+    parser.add_argument("--seeds", nargs="*", type=int, default=None, help="the seeds to run each pair of configs with (default one run, unseeded)")
+    parser.add_argument("--cores", type=int, default=os.cpu_count(), help="how many cores the runs may take at once")
+    parser.add_argument("--port", type=int, default=6100, help="the first port given to the runs")
+    parser.add_argument("--log-dir", default=None, help="directory to save the runs' log directories and the summary in")
+    args = parser.parse_args()
+
+    batch_dir = args.log_dir
+    if batch_dir is None:
+        batch_dir = os.path.join("logs", "batch-" + dt.now().strftime("%Y-%m-%d-%H-%M-%S"))
+    os.makedirs(batch_dir, exist_ok=True)
+
+    experiments = []
+    for server_config in args.configs:
+        for client_config in args.client_configs or [None]:
+            for seed in args.seeds or [None]:
+                name = server_config
+                if client_config is not None:
+                    name += "-" + os.path.splitext(client_config)[0]
+                if seed is not None:
+                    name += "-" + str(seed)
+                experiments.append(Experiment(server_config, client_config, seed, os.path.join(batch_dir, name)))
+
+    print(dt.now(), "Running {} experiments on {} cores.".format(len(experiments), args.cores), flush=True)
+    start_time = time.time()
+    run_batch(experiments, args.cores, args.port)
+
+    summary = pandas.DataFrame([e.summary() for e in experiments])
+    summary.to_csv(os.path.join(batch_dir, "Summary.csv"), index=False)
+
+    # the runs of each pair of configs, over the seeds
+    summary["Client Config"] = summary["Client Config"].fillna("")
+    fitness = ["Best Fitness", "Final Fitness", "Mean Final Fitness"]
+    summary[fitness] = summary[fitness].apply(pandas.to_numeric)
+    grouped = summary.groupby(["Server Config", "Client Config"], sort=False)[fitness].agg(["mean", "std"])
+    grouped.insert(0, ("Runs", ""), summary.groupby(["Server Config", "Client Config"], sort=False).size())
+
+    print()
+    print(summary.drop(columns=["Log Dir"]).to_string(index=False))
+    print()
+    print(grouped.to_string())
+    print()
+    print(dt.now(), "Ran {} experiments in {:.0f} seconds, the summary is in {}".format(len(experiments), time.time() - start_time, os.path.join(batch_dir, "Summary.csv")))
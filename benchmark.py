@@ -0,0 +1,265 @@
+################################################################################
+# TRAVELING SALESMAN PROBLEM - BENCHMARKS
+# Olga Koldachenko          okold525@mtroyal.ca
+# COMP 5690                 Senior Computer Science Project
+# Mount Royal University    Winter 2022
+#
+# Measures the performance of parts of the stakeholder search, without a server.
+# Each result is printed as a line of JSON (and appended to --output, if given),
+# so runs can be compared between releases. Running:
+#   python benchmark.py --seconds 10 --stakeholders 4
+# compares the execution models on tsp100 and tsp500, with four stakeholders
+# running at the same time, then PyGAD with the native GA (see tspga.NativeGA).
+# It then times the hot paths on every problem in problems/, and on generated
+# problems of 1000 and 5000 cities. Running:
+#   python benchmark.py --suite hot --sizes 1000 --output bench.jsonl
+# only times the hot paths, on one generated size, saving the results.
+#
+# Every hot path result has the benchmark's name, the problem and its number of
+# cities, and the best seconds per call out of --repeat tries:
+#   lookup_tables      - tsp.create_lookup_tables
+#   total, total_cached, fitness, total_batch, best
+#                      - the tsp functions, on random tours (or a population of
+#                        200 for total_batch and best)
+#   crossover          - the cascade crossover making one generation's offspring
+#   generation         - one generation of create_tspga(...).run() with each
+#                        engine (which includes scoring the whole population
+#                        once more, as run() always starts by doing)
+#   find_top_solutions - Committee.find_top_solutions for 24 stakeholders
+#   round              - a round in this process: workers started in threads,
+#                        the problem sent, the GAs stopped, their results 
+#                        ranked and sent back, with overhead being the part of
+#                        the round that wasn't spent running the GAs
+#
+#       best_time(func, repeat = 5, number = 1)
+# Returns the best of repeat times for number calls of func, per call.
+#
+#       bench_hot_paths(problem, name, repeat = 5)
+# Times the hot paths on a problem (a DataFrame), reporting each result.
+#
+#       bench_round(problem, stakeholders = 3, seconds = 0.5, engine = "pygad")
+# Runs a round in this process, with the GAs running for the given seconds,
+# returning how long it took and its overhead.
+#
+#       bench_execution(problem_file, execution, seconds, stakeholders, 
+#                       engine = "pygad")
+# Runs the GA of the given number of stakeholders for the given number of
+# seconds, with tsp_worker in a thread or its own process (see client.py), and
+# returns the number of generations per second per stakeholder. engine is the
+# GA the workers run, "pygad" or "native".
+from datetime import datetime as dt
+from tspserver import Committee
+from tspga import create_tspga
+import numpy as np
+import argparse
+import tempfile
+import client
+import log
+import shutil
+import json
+import time
+import tsp
+import os
+import re
+
+GENERATIONS = re.compile(r"ran (\d+) generations")
+
+# returns the number of generations reported in a client log file
+def count_generations(log_path):
+    total = 0
+    try:
+        with open(log_path) as f:
+            for line in f:
+                match = GENERATIONS.search(line)
+                if match is not None:
+                    total += int(match.group(1))
+    except FileNotFoundError:
+        pass
+    return total
+
+def bench_execution(problem_file, execution = "thread", seconds = 10, stakeholders = 1, engine = "pygad"):
+    problem = tsp.load(os.path.join("problems", problem_file))
+    distance_table, time_table, distance_norm, time_norm = tsp.create_lookup_tables(problem)
+    weighted = tsp.create_weighted_table(0.5, 0.5, distance_norm, time_norm)
+
+    log_dir = tempfile.mkdtemp()
+    workers = []
+    for i in range(0, stakeholders):
+        log_path = os.path.join(log_dir, "{}.txt".format(i))
+        worker, complete, stop_ga, conn = client.start_worker(execution, log_path=log_path, ga_engine=engine)
+        conn.send(("init", weighted, distance_table, time_table, weighted))
+        workers.append((worker, complete, stop_ga, conn, log_path))
+
+    time.sleep(seconds)
+
+    # stops the GAs the same way a "req_result" does
+    for worker, complete, stop_ga, conn, log_path in workers:
+        stop_ga.set()
+    for worker, complete, stop_ga, conn, log_path in workers:
+        conn.recv()
+        complete.set()
+    for worker, complete, stop_ga, conn, log_path in workers:
+        worker.join()
+
+    # thread workers log through this process's buffered writer
+    log.flush()
+    generations = 0
+    for worker, complete, stop_ga, conn, log_path in workers:
+        generations += count_generations(log_path)
+    shutil.rmtree(log_dir)
+
+    return generations / seconds / stakeholders
+
+def best_time(func, repeat = 5, number = 1):
+    times = []
+    for i in range(0, repeat):
+        start = time.perf_counter()
+        for j in range(0, number):
+            func()
+        times.append((time.perf_counter() - start) / number)
+    return min(times)
+
+def bench_hot_paths(problem, name, repeat = 5):
+    N = len(problem)
+    values = {"problem": name, "cities": N, "repeat": repeat}
+    rng = np.random.default_rng()
+
+    start = time.perf_counter()
+    distance_table, time_table, distance_norm, time_norm = tsp.create_lookup_tables(problem, chunk_size=512)
+    report("lookup_tables", seconds=time.perf_counter() - start, **values)
+    weighted = tsp.create_weighted_table(0.5, 0.5, distance_norm, time_norm)
+
+    population = np.argsort(rng.random((200, N)), axis=1) + 1
+    tour = population[0]
+    number = max(1, 100000 // N)
+
+    report("total", seconds=best_time(lambda: tsp.total(weighted, tour, cached=False), repeat, number), **values)
+    tsp.total(weighted, tour)
+    report("total_cached", seconds=best_time(lambda: tsp.total(weighted, tour), repeat, number), **values)
+    report("fitness", seconds=best_time(lambda: tsp.fitness(weighted, tour), repeat, number), **values)
+    report("total_batch", seconds=best_time(lambda: tsp.total_batch(weighted, population), repeat), **values)
+    tsp.tour_cache.clear()
+    report("best", seconds=best_time(lambda: tsp.best(population, weighted), repeat), **values)
+
+    # the crossover is made by create_tspga, and is the same for both engines
+    for engine in ["pygad", "native"]:
+        instance = create_tspga(weighted, distance_table, time_table, population=population.copy(), log_generations="off", engine=engine)
+        instance.num_generations = 1
+        report("generation", engine=engine, seconds=best_time(instance.run, repeat), **values)
+
+    parents = population[:max(N // 2, 2)]
+    report("crossover", seconds=best_time(lambda: instance.crossover_func(parents, (195, N), instance), repeat), **values)
+
+    committee = Committee(distance_table, time_table)
+    for i in range(0, 24):
+        committee.add(None, str(i))
+        committee.stakeholder_list[i].last_result = population[i]
+    tsp.tour_cache.clear()
+    report("find_top_solutions", seconds=best_time(lambda: committee.find_top_solutions(weighted), repeat), **values)
+
+# waits until every worker has taken its message and started its GA, so
+# stop_ga isn't set before the worker clears it
+def wait_for_start(workers):
+    for worker, complete, stop_ga, conn in workers:
+        while stop_ga.is_set():
+            time.sleep(0.001)
+
+def bench_round(problem, stakeholders = 3, seconds = 0.5, engine = "pygad"):
+    distance_table, time_table, distance_norm, time_norm = tsp.create_lookup_tables(problem, chunk_size=512)
+    weighted = tsp.create_weighted_table(0.5, 0.5, distance_norm, time_norm)
+    committee = Committee(distance_table, time_table)
+
+    start = time.perf_counter()
+    workers = []
+    for i in range(0, stakeholders):
+        worker, complete, stop_ga, conn = client.start_worker("thread", log_path=None, ga_engine=engine)
+        conn.send(("init", weighted, distance_table, time_table, weighted))
+        workers.append((worker, complete, stop_ga, conn))
+        committee.add(None, str(i))
+
+    wait_for_start(workers)
+    time.sleep(seconds)
+
+    for worker, complete, stop_ga, conn in workers:
+        stop_ga.set()
+    for i in range(0, stakeholders):
+        committee.stakeholder_list[i].last_result = workers[i][3].recv()
+        committee.stakeholder_list[i].stats = workers[i][3].recv()[1]
+    top = committee.find_top_solutions(weighted)
+    for worker, complete, stop_ga, conn in workers:
+        conn.send(("continue", top))
+
+    # the round ends once every GA has taken its new solutions and resumed
+    wait_for_start(workers)
+    elapsed = time.perf_counter() - start
+
+    for worker, complete, stop_ga, conn in workers:
+        stop_ga.set()
+    for worker, complete, stop_ga, conn in workers:
+        conn.recv()
+        complete.set()
+        worker.join()
+
+    return elapsed, elapsed - seconds
+
+output = None           # a file the results are also appended to
+
+# prints a result as a line of JSON
+def report(benchmark, **values):
+    values = dict({"benchmark": benchmark, "time": str(dt.now())}, **values)
+    print(json.dumps(values), flush=True)
+    if output is not None:
+        with open(output, "a") as f:
+            f.write(json.dumps(values) + "\n")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the stakeholder search.")
+    parser.add_argument("--suite", choices=["all", "execution", "hot"], default="all", help="which benchmarks to run")
+    parser.add_argument("--problems", nargs="+", default=None, help="problem files in problems/ (default tsp100.csv and tsp500.csv for the execution benchmarks, and every file for the hot paths)")
+    parser.add_argument("--sizes", nargs="*", type=int, default=[1000, 5000], help="sizes of generated problems to time the hot paths on")
+    parser.add_argument("--seconds", type=float, default=10, help="how long to run each GA benchmark")
+    parser.add_argument("--stakeholders", type=int, default=1, help="how many GAs run at the same time")
+    parser.add_argument("--repeat", type=int, default=5, help="how many times each hot path is timed")
+    parser.add_argument("--output", default=None, help="a file to append the JSON results to")
+    args = parser.parse_args()
+    output = args.output
+
+    if args.suite in ["all", "execution"]:
+        for problem_file in args.problems or ["tsp100.csv", "tsp500.csv"]:
+            for execution in ["thread", "process"]:
+                report("execution",
+                       problem=problem_file,
+                       execution=execution,
+                       stakeholders=args.stakeholders,
+                       seconds=args.seconds,
+                       generations_per_second=bench_execution(problem_file, execution, args.seconds, args.stakeholders))
+
+            # the engines are compared in threads, which is the default
+            speeds = {}
+            for engine in ["pygad", "native"]:
+                speeds[engine] = bench_execution(problem_file, "thread", args.seconds, args.stakeholders, engine)
+                report("engine",
+                       problem=problem_file,
+                       engine=engine,
+                       stakeholders=args.stakeholders,
+                       seconds=args.seconds,
+                       generations_per_second=speeds[engine],
+                       speedup=speeds[engine] / speeds["pygad"] if speeds["pygad"] > 0 else None)
+
+    if args.suite in ["all", "hot"]:
+        problem_files = args.problems or sorted(os.listdir("problems"), key=lambda f: os.path.getsize(os.path.join("problems", f)))
+        problems = [(f, tsp.load(os.path.join("problems", f))) for f in problem_files]
+
+        # generated problems are only kept for the run
+        generated_dir = tempfile.mkdtemp()
+        for N in args.sizes:
+            path = os.path.join(generated_dir, "generated{}.csv".format(N))
+            tsp.generate(N, path)
+            problems.append(("generated{}".format(N), tsp.load(path)))
+        shutil.rmtree(generated_dir)
+
+        for name, problem in problems:
+            bench_hot_paths(problem, name, args.repeat)
+            for engine in ["pygad", "native"]:
+                elapsed, overhead = bench_round(problem, engine=engine)
+                report("round", problem=name, cities=len(problem), engine=engine, stakeholders=3, seconds=elapsed, overhead=overhead)
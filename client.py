@@ -8,19 +8,45 @@
 # traveling salesman problem. It receives information from the server and runs
 # a GA, which can be interrupted.
 #
-#       load(filename, pop_multiplier, log_dir)
+# It can also be run on its own, to add stakeholders from another machine to a
+# server started by stake.py (with remote_clients set in its config):
+#   python client.py coop.csv --host 192.168.0.10 --port 6000 --authkey secret
+# starts every stakeholder in client_configs/coop.csv and connects them to the
+# server. Run it with --help for the other options.
+#
+#       load(filename, pop_multiplier, log_dir, address, authkey, seed)
 # Returns a list of Process objects, each of which runs tsp_client.
 #
 # PARAMETERS
 # filename:           - name of the config file (default "default.csv")
 # pop_multiplier:     - how many times to duplicate each config (default 1)
 # log_dir:            - directory to save the log files (default None)
+# address:            - the address of the server (default ('localhost', 6000))
+# authkey:            - the server's authkey, as bytes (default None)
+# seed:               - if given, the stakeholders are seeded with seed, 
+#                       seed + 1, ... in order (default None)
+#
+# Besides the required columns, a config file may have a binary_tours column,
+# an execution column ("thread" or "process"), a cores column (how many CPUs
+# each stakeholder's GA is pinned to, handed out in turn), a log_generations
+# column (see tspga.py), local_search, local_search_every and neighbors
+# columns (see tsp_client), initial_population and ga_engine columns (see
+# tspga.py), and a profile column.
 #
 #
 #       tsp_client(name, distance_weight, time_weight, use_other_solution, 
-#                   share_chair_weights, address, log_path)
+#                   share_chair_weights, address, log_path, binary_tours,
+#                   authkey, execution, cores, log_generations, local_search,
+#                   local_search_every, neighbors, initial_population,
+#                   ga_engine, profile, seed)
 # This function is the main function which should be set as the target when
-# creating a new process. It's responsible for communicating with the server.
+# creating a new process. It's responsible for communicating with the server,
+# including answering "req_status" with its GA's progress (see 
+# tspserver.RoundScheduler), and passing migrants between the server and the
+# worker when the server asks for migration with "migrate". Before each result,
+# it sends the server ("stats", summary), the time its worker and itself spent
+# in each phase of the round (see tspstats.py). While migrating, it passes one
+# on whenever the worker sends one instead.
 #
 # PARAMETERS
 # name:               - name of the client as printed by the server, otherwise 
@@ -31,13 +57,54 @@
 #                       the next round of search (default True)
 # share_chair_weights:- whether to share the solution best for the chair
 # address:            - the address of the server (default ('localhost', 6000))
-# log_path:           - the path to the log file (default None)
+# log_path:           - the path to the log file (default None), the tours are
+#                       recorded next to it (see tsprecord.py)
+# binary_tours:       - whether to ask the server to exchange tours in the 
+#                       tspwire format instead of as pickles (default False)
+# authkey:            - the server's authkey, as bytes (default None)
+# execution:          - where the GA runs, "thread" (a thread in the client's
+#                       process) or "process" (its own process, leaving the
+#                       client's process to do I/O) (default "thread")
+# cores:              - a list of CPUs to pin the GA to (default None)
+# log_generations:    - which GA generations are logged (default "all", see
+#                       tspga.py)
+# local_search:       - "2opt", "oropt" or "both" to improve the GA's best 
+#                       solution with tsplocal after each GA run (default "off")
+# local_search_every: - if more than 0, also improves it every this many 
+#                       generations (default 0)
+# neighbors:          - how many nearest cities the local search tries joining
+#                       each city to, taken from the server's neighbor index
+#                       (default 8). The server only finds its own neighbors
+#                       setting's worth (default 16), so if this is more, the
+#                       worker finds its own lists with tsplocal.neighbor_lists
+#                       instead, which takes longer on big problems
+# initial_population: - how the first GA's population is made, "seeded", 
+#                       "random" or "pygad" (default "seeded", see tspga.py)
+# ga_engine:          - "pygad" or "native", the GA the worker runs (default
+#                       "pygad", see tspga.NativeGA)
+# profile:            - if True, the GA runs are profiled with cProfile, and
+#                       the stats saved next to the log file after each run
+#                       (see tspstats.profile_path) (default False)
+# seed:               - seeds the random module and numpy's global generator
+#                       in the worker, which all of the GA's random choices 
+#                       come from (default None). Rounds are timed, so this 
+#                       makes the GA's moves repeatable but not the run.
+#
+#
+#       start_worker(execution, cores, use_other_solution, log_path, 
+#                   share_chair_weights, log_generations, local_search,
+#                   local_search_every, neighbors, initial_population,
+#                   progress, ga_engine, profile, seed)
+# Starts tsp_worker in a thread or a process, returning the thread/process, the
+# complete and stop_ga events, and the client's end of the pipe to it.
 #
 #
 #       tsp_worker(complete, stop_ga, conn_worker, use_other_solution, 
-#                   log_path, share_chair_weights)
+#                   log_path, share_chair_weights, cores, log_generations,
+#                   local_search, local_search_every, neighbors,
+#                   initial_population, progress, ga_engine, profile, seed)
 # THIS FUNCTION SHOULD NOT BE CALLED ON ITS OWN, but is rather run in a thread
-# created by tsp_client. It is responsible for the GA.
+# or process created by tsp_client. It is responsible for the GA.
 #
 # PARAMETERS
 # complete:           - an event which is set when the server is done
@@ -47,22 +114,61 @@
 #                       the next round of search (default True)
 # log_path:           - the path to the log file (default None)
 # share_chair_weights - whether to share the solution best for the chai
-from multiprocessing.connection import Client, Pipe
+# cores:              - a list of CPUs to pin the GA to (default None)
+# log_generations:    - which GA generations are logged (default "all")
+# local_search:       - the local search after each GA run (default "off")
+# local_search_every: - how often it also runs during the GA (default 0)
+# neighbors:          - the size of its neighbor lists (default 8), found by the
+#                       worker itself if the server's index is narrower
+# initial_population: - how the first GA's population is made (default 
+#                       "seeded")
+# progress:           - a shared array the GA reports its progress in, sent to
+#                       the server when it asks with "req_status" (default None)
+# ga_engine:          - "pygad" or "native" (default "pygad")
+# profile:            - whether to profile the GA runs (default False)
+# seed:               - the seed for its random choices (default None)
+#
+# A result is only sent once stop_ga is set, a GA which reaches its generation
+# limit before then being resumed. After each result, the worker sends 
+# ("stats", summary), the time it spent in each phase since the last one. While
+# migrating, it also sends one every migration_interval seconds.
+from multiprocessing.connection import Client, Pipe, wait
 from multiprocessing import Process
-from operator import truediv
+import multiprocessing
 from threading import Event, Thread
-from tspga import create_tspga
-from datetime import datetime as dt
+from tspga import GAEngine, merge_migrants
+from tspshared import SharedTablesHandle
 import numpy as np
+import argparse
+import cProfile
 import pandas
+import pickle
+import random
 import time
+import tsprecord
+import tsplocal
+import tspstats
+import tspwire
 import tsp
 import log
 import os
 
+# how long (in seconds) the command loops block waiting for a message before
+# checking whether the search is complete
+WAIT_TIMEOUT = 1
+
+# returns the value of an optional column in a config file
+def option(config, i, column, default):
+    if column in config.columns and not pandas.isna(config.at[i, column]):
+        return config.at[i, column]
+    return default
+
 def load(   filename = None, 
             pop_multiplier = 1,
-            log_dir = None):
+            log_dir = None,
+            address = ('localhost', 6000),
+            authkey = None,
+            seed = None):
     if filename is None:
         filename = "default.csv"
 
@@ -70,6 +176,7 @@ def load(   filename = None,
     config = pandas.read_csv(path)
 
     client_list = []
+    next_cpu = 0
 
     for i in range(0,len(config)):      # for each config
         for j in range(0, pop_multiplier):  # how many duplicates
@@ -84,6 +191,14 @@ def load(   filename = None,
                 except:
                     log_path = None
 
+            execution = option(config, i, "execution", "thread")
+            cores = None
+            num_cores = int(option(config, i, "cores", 0))
+            if num_cores > 0:
+                cores = [(next_cpu + k) % os.cpu_count() for k in range(0, num_cores)]
+                next_cpu += num_cores
+
+            # daemonic processes can't start the GA's process
             client_list.append(
                 Process(target=tsp_client, kwargs={
                     "name": name,
@@ -91,9 +206,22 @@ def load(   filename = None,
                     "time_weight": config.at[i, "time"],
                     "use_other_solution": config.at[i, "use_other_solution"],
                     "share_chair_weights": config.at[i, "share_chair_weights"],
-                    "log_path": log_path
+                    "log_path": log_path,
+                    "binary_tours": option(config, i, "binary_tours", False),
+                    "address": address,
+                    "authkey": authkey,
+                    "execution": execution,
+                    "cores": cores,
+                    "log_generations": option(config, i, "log_generations", "all"),
+                    "local_search": option(config, i, "local_search", "off"),
+                    "local_search_every": int(option(config, i, "local_search_every", 0)),
+                    "neighbors": int(option(config, i, "neighbors", 8)),
+                    "initial_population": option(config, i, "initial_population", "seeded"),
+                    "ga_engine": option(config, i, "ga_engine", "pygad"),
+                    "profile": bool(option(config, i, "profile", False)),
+                    "seed": None if seed is None else seed + len(client_list)
                     },
-                    daemon=True
+                    daemon=(execution != "process")
                 )
             )
 
@@ -105,102 +233,319 @@ def tsp_client( name = "Client",
                 use_other_solution = True,
                 share_chair_weights = False,
                 address = ('localhost', 6000),
-                log_path = None):
+                log_path = None,
+                binary_tours = False,
+                authkey = None,
+                execution = "thread",
+                cores = None,
+                log_generations = "all",
+                local_search = "off",
+                local_search_every = 0,
+                neighbors = 8,
+                initial_population = "seeded",
+                ga_engine = "pygad",
+                profile = False,
+                seed = None):
 
-    complete = Event()
-    stop_ga = Event()
-    stop_ga.set()
+    # the GA's generations completed, and generations without improving
+    progress = multiprocessing.Array("i", 2)
 
-    conn_inner, conn_worker = Pipe()
-    time_table = None
-
-    t1 = Thread(target=tsp_worker, 
-                args=[complete, stop_ga, conn_worker],
-                kwargs={"use_other_solution": use_other_solution,
-                        "log_path": log_path,
-                        "share_chair_weights": share_chair_weights})
-    t1.start()
+    t1, complete, stop_ga, conn_inner = start_worker(execution, cores,
+                                                     use_other_solution,
+                                                     log_path,
+                                                     share_chair_weights,
+                                                     log_generations,
+                                                     local_search,
+                                                     local_search_every,
+                                                     neighbors,
+                                                     initial_population,
+                                                     progress,
+                                                     ga_engine,
+                                                     profile,
+                                                     seed)
     
     conn = None
     while conn == None:
         try:    
-            conn = Client(address)
-        except ConnectionRefusedError:
+            conn = Client(address, authkey=authkey)
+        except (ConnectionRefusedError, ConnectionResetError):
             time.sleep(1)    
-    conn.send(name)
 
-    # creates an empty log file
-    try:
-        if log_path != None:
-            f = open(log_path, 'w')
-            f.write("Name: {}\nDistance Weight: {}\nTime Weight: {}\nUse Other Solution: {}\nResult Strategy: {}\n\n".format(name, distance_weight, time_weight, use_other_solution, share_chair_weights))
-            f.close()
-    except:
-        print(dt.now(), name, "could not open log file", log_path)
+    # asks for the binary tour format, which the server may turn down
+    binary = False
+    reference = None        # the best solution from the last round
+    if binary_tours:
+        conn.send((name, [tspwire.BINARY]))
+        binary = conn.recv() == ("wire", tspwire.BINARY)
+    else:
+        conn.send(name)
+
+    # creates the log file
+    log.create(log_path, "Name: {}\nDistance Weight: {}\nTime Weight: {}\nUse Other Solution: {}\nResult Strategy: {}\n\n".format(name, distance_weight, time_weight, use_other_solution, share_chair_weights))
+
+    # tours are recorded next to the log file
+    recorder = tsprecord.get(tsprecord.path_for(log_path))
+    if recorder is not None:
+        recorder.create()
+        recorder.name(0, name)
 
     current_round = 1
+    round_cpu_time = time.thread_time()
+    migrating = False       # whether the worker's solutions go to the server
+    timers = tspstats.Timers()
     while complete.is_set() == False:
-        if conn.poll():
-            cmd = conn.recv()
+        # blocks until the server (or a migrating worker) sends something
+        with timers.time("client_wait"):
+            ready = wait([conn, conn_inner] if migrating else [conn], timeout=WAIT_TIMEOUT)
+
+        # passes the worker's solutions on as they're found
+        if conn_inner in ready:
+            message = conn_inner.recv()
+            if isinstance(message, tuple) and message[0] == "stats":
+                timers.merge(message[1])
+                conn.send(("stats", timers.summary()))
+                continue
+            if isinstance(message, tuple):
+                message = message[1]
+            conn.send(("migrant", message))
+
+        if conn in ready:
+            dispatch_start = time.perf_counter()
+            if binary:
+                data = conn.recv_bytes()
+                if tspwire.is_frame(data):
+                    cmd = ("continue", tspwire.decode(data, reference))
+                else:
+                    cmd = pickle.loads(data)
+            else:
+                cmd = conn.recv()
 
             if cmd[0] == "init":
-                problem = tsp.create_weighted_table(distance_weight, time_weight, cmd[1], cmd[2])
+                # the tables are either sent in full, or as a shared memory handle
+                # which the worker attaches to itself
+                if isinstance(cmd[1], SharedTablesHandle):
+                    distance_norm, time_norm, distance_table, time_table = cmd[1].attach()[:4]
+                    problem = tsp.create_weighted_table(distance_weight, time_weight, distance_norm, time_norm)
+                    message = ("init", problem, cmd[1])
+                else:
+                    distance_table, time_table = cmd[3], cmd[4]
+                    problem = tsp.create_weighted_table(distance_weight, time_weight, cmd[1], cmd[2])
+                    message = ("init", problem) + tuple(cmd[3:])
                 log.hr(log_path)
                 log.write(log_path, "R{}".format(current_round), timestamp=True)
                 log.write(log_path, "Received traveling salesman problem.", timestamp=True)
-                conn_inner.send(("init",problem, cmd[3], cmd[4], cmd[5]))
+                conn_inner.send(message)
 
             if cmd == "req_result":
                 log.write(log_path, "Received request for current result. Stopping the GA.", timestamp=True)
                 stop_ga.set()
                 result = conn_inner.recv()
-                conn.send(result)
+                timers.merge(conn_inner.recv()[1])
+
+                # the time spent on this command so far counts towards the summary
+                timers.add("dispatch", time.perf_counter() - dispatch_start)
+                dispatch_start = time.perf_counter()
+                conn.send(("stats", timers.summary()))
+                if binary:
+                    conn.send_bytes(tspwire.encode([result], reference))
+                else:
+                    conn.send(result)
+                log.write(log_path, "Command loop CPU time for R{}: {:.4f} seconds".format(current_round, time.thread_time() - round_cpu_time), timestamp=True)
+                round_cpu_time = time.thread_time()
+                if recorder is not None:
+                    recorder.flush()
 
             if cmd[0] == "continue":
                 current_round += 1
                 log.hr(log_path)
                 log.write(log_path, "R{}".format(current_round), timestamp=True)
-                log.write(log_path, "New population sent by server:".format(current_round), timestamp=True)
-                
-                log.write(log_path, tsp.pop_string(cmd[1]))
+                log.write(log_path, "New population sent by server: {} solutions".format(len(cmd[1])), timestamp=True)
+
+                if len(cmd[1]) > 0:
+                    reference = cmd[1][0]
+                    if recorder is not None:
+                        recorder.tours(tsprecord.POPULATION, cmd[1], current_round,
+                                       tsp.total_batch(distance_table, cmd[1]),
+                                       tsp.total_batch(time_table, cmd[1]),
+                                       tsp.fitness_batch(problem, cmd[1]))
                 
                 conn_inner.send(("continue", cmd[1]))
 
+            # the migration messages go straight to the worker
+            if cmd[0] == "migrate":
+                migrating = True
+                conn_inner.send(cmd)
+
+            if cmd[0] == "migrants":
+                conn_inner.send(cmd)
+
+            if cmd == "req_status":
+                conn.send(("status", progress[0], progress[1]))
+
             if cmd == "stop":
                 log.write(log_path, "Received stop!", timestamp=True)
                 stop_ga.set()
                 complete.set()
+
+            timers.add("dispatch", time.perf_counter() - dispatch_start)
     
     #conn.close()
     #conn_inner.close()
     t1.join()
 
+def start_worker(execution = "thread",
+                 cores = None,
+                 use_other_solution = True,
+                 log_path = None,
+                 share_chair_weights = False,
+                 log_generations = "all",
+                 local_search = "off",
+                 local_search_every = 0,
+                 neighbors = 8,
+                 initial_population = "seeded",
+                 progress = None,
+                 ga_engine = "pygad",
+                 profile = False,
+                 seed = None):
+
+    if execution == "process":
+        complete = multiprocessing.Event()
+        stop_ga = multiprocessing.Event()
+    else:
+        complete = Event()
+        stop_ga = Event()
+    stop_ga.set()
+
+    conn_inner, conn_worker = Pipe()
+
+    args = [complete, stop_ga, conn_worker]
+    kwargs = {"use_other_solution": use_other_solution,
+              "log_path": log_path,
+              "share_chair_weights": share_chair_weights,
+              "cores": cores,
+              "log_generations": log_generations,
+              "local_search": local_search,
+              "local_search_every": local_search_every,
+              "neighbors": neighbors,
+              "initial_population": initial_population,
+              "progress": progress,
+              "ga_engine": ga_engine,
+              "profile": profile,
+              "seed": seed}
+
+    if execution == "process":
+        worker = Process(target=tsp_worker, args=args, kwargs=kwargs, daemon=True)
+    else:
+        worker = Thread(target=tsp_worker, args=args, kwargs=kwargs)
+    worker.start()
+
+    return worker, complete, stop_ga, conn_inner
+
 def tsp_worker(complete, stop_ga, conn_worker, 
                 use_other_solution = True, 
                 log_path = None, 
-                share_chair_weights = False):
+                share_chair_weights = False,
+                cores = None,
+                log_generations = "all",
+                local_search = "off",
+                local_search_every = 0,
+                neighbors = 8,
+                initial_population = "seeded",
+                progress = None,
+                ga_engine = "pygad",
+                profile = False,
+                seed = None):
+
+    # the worker is the only thread using them in its client's process
+    if seed is not None:
+        random.seed(seed)
+        np.random.seed(seed)
 
-    population = distance_table = time_table = chair_weights = None
+    # on linux this pins only the calling thread, so it works for both models
+    if cores is not None and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, cores)
+        except OSError:
+            log.write(log_path, "Could not pin the GA to CPUs {}.".format(cores))
+
+    engine = distance_table = time_table = chair_weights = None
     problem = None
     count = 1
+    recorder = tsprecord.get(tsprecord.path_for(log_path))
+
+    if local_search == "off":
+        local_search = None
+    neighbor_table = None
+
+    timers = tspstats.Timers()
+    profiler = cProfile.Profile() if profile else None
+
+    migration_interval = None       # set by "migrate", see tspserver.py
+    last_sent = [0, None]           # when the last migrant was sent, and which
+
+    # merges the migrants the server sent, and sends the best solution to the
+    # server at most once every migration_interval seconds, while the GA runs
+    def migrate(g):
+        while conn_worker.poll():
+            cmd = conn_worker.recv()
+            if cmd[0] == "migrants" and use_other_solution:
+                merged = merge_migrants(problem, g.population, g.last_generation_fitness, cmd[1])
+                if merged > 0:
+                    log.write(log_path, "Merged {} migrants in generation {}.".format(merged, g.generations_completed), timestamp=True)
+
+        if time.time() - last_sent[0] >= migration_interval:
+            if share_chair_weights == False:
+                sol = g.population[np.argmax(g.last_generation_fitness)]
+            else:
+                sol = g.population[np.argmax(tsp.fitness_batch(chair_weights, g.population))]
+
+            if last_sent[1] is None or not np.array_equal(sol, last_sent[1]):
+                conn_worker.send(("migrant", sol.copy()))
+                last_sent[1] = sol.copy()
+            last_sent[0] = time.time()
+
+            # the server never asks for a result, so the round's summary goes
+            # out with the migrants
+            conn_worker.send(("stats", timers.summary()))
 
     while complete.is_set() == False:
-        # checks for any commands
+        # checks for any commands, blocking while the GA is stopped
         try:
-            if conn_worker.poll():
+            wait_start = time.perf_counter()
+            ready = conn_worker.poll(WAIT_TIMEOUT if stop_ga.is_set() else 0)
+            timers.add("worker_wait", time.perf_counter() - wait_start, 0)
+            if ready:
                 try:
                     cmd = conn_worker.recv()
+                    if cmd[0] == "migrate":
+                        migration_interval = cmd[1]
+                        log.write(log_path, "Exchanging migrants every {} seconds.".format(migration_interval), timestamp=True)
+
                     if cmd[0] == "init":
                         problem = cmd[1]
-                        distance_table = cmd[2]
-                        time_table = cmd[3]
-                        chair_weights = cmd[4]
+                        if isinstance(cmd[2], SharedTablesHandle):
+                            tables = cmd[2].attach()[2:]
+                        else:
+                            tables = cmd[2:]
+                        distance_table, time_table, chair_weights = tables[:3]
+
+                        # uses the server's neighbor index if it sent one, and
+                        # it's wide enough
+                        N = np.shape(problem)[0]
+                        if len(tables) > 3 and tables[3].shape[1] >= min(neighbors, N - 1):
+                            neighbor_table = tables[3][:, :neighbors]
+                        else:
+                            if len(tables) > 3:
+                                log.write(log_path, "The server sent {} neighbors per city, finding {} instead.".format(tables[3].shape[1], neighbors), timestamp=True)
+                            neighbor_table = tsplocal.neighbor_lists(problem, neighbors)
                         stop_ga.clear()
 
                     if cmd[0] == "continue":
+                        # the scheduler only judges this round's generations
+                        engine.new_round()
                         if use_other_solution:
-                            population = np.vstack((population, cmd[1]))
-                            log.write(log_path, "Adding solutions to the pop pool.")
+                            merged = engine.inject(cmd[1])
+                            log.write(log_path, "Adding {} of {} solutions to the pop pool.".format(merged, len(cmd[1])))
                         else:
                             log.write(log_path, "Rejecting solutions.")
                         stop_ga.clear()
@@ -213,31 +558,94 @@ def tsp_worker(complete, stop_ga, conn_worker,
             complete.set()
             stop_ga.set()
 
-        # creates and runs a GA                                 
+        # creates the GA the first time, and resumes it after that
         if stop_ga.is_set() == False:
-            log.write(log_path, "Starting GA {}".format(count), timestamp=True)
-            if population is None:
-                log.write(log_path, "Creating initial population.", timestamp=True)
-            #else:
-                #log.write(log_path, "Current population:\n{}".format(pop_string(population)))
-            instance = create_tspga(    problem,
-                                        distance_table,
-                                        time_table,
-                                        stop_ga = stop_ga, 
-                                        population=population,
-                                        log_path=log_path)
-            instance.run()
-            population = instance.population
+            if engine is None:
+                log.write(log_path, "Creating initial population ({}) for the {} GA.".format(initial_population, ga_engine), timestamp=True)
+                engine = GAEngine(  problem,
+                                    distance_table,
+                                    time_table,
+                                    stop_ga = stop_ga, 
+                                    log_path=log_path,
+                                    recorder=recorder,
+                                    log_generations=log_generations,
+                                    local_search=local_search,
+                                    local_search_every=local_search_every,
+                                    neighbors=neighbor_table,
+                                    initial_population=initial_population,
+                                    progress=progress,
+                                    migration=None if migration_interval is None else migrate,
+                                    engine=ga_engine,
+                                    timers=timers)
+                log.write(log_path, "Starting GA", timestamp=True)
+            else:
+                log.write(log_path, "Resuming GA for run {}".format(count), timestamp=True)
+            ga_start = time.time()
+            if profiler is not None:
+                profiler.enable()
+            with timers.time("ga"):
+                generations = engine.run(count)
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(tspstats.profile_path(log_path))
+            instance = engine.instance
+            ga_time = time.time() - ga_start
+            log.write(log_path, "GA run {} ran {} generations in {:.2f} seconds ({:.1f} generations/s)".format(count, generations, ga_time, generations / max(ga_time, 1e-9)), timestamp=True)
+
+            # a run that reached its generation limit carries on, so the only
+            # result waiting for the client is the one it asked for
+            if not stop_ga.is_set():
+                continue
+
+            if local_search is not None:
+                search_start = time.time()
+                with timers.time("local_search"):
+                    moves = tsplocal.improve_best(problem, instance.population, engine.fitness, neighbor_table, local_search)
+                log.write(log_path, "Local search made {} moves in {:.2f} seconds".format(moves, time.time() - search_start), timestamp=True)
             
             if share_chair_weights == False:
-                sol, _, _ = instance.best_solution()
-                log.write(log_path, "Sending best solution to server:\n{}".format(str(sol)), timestamp=True)
-                conn_worker.send(sol)
+                sol = engine.best()
+                log.write(log_path, "Sending best solution to server.", timestamp=True)
+                with timers.time("ipc"):
+                    conn_worker.send(sol)
             else:
-                sol = tsp.best(population, chair_weights)
-                log.write(log_path, "Sending best solution for chair to server:\n{}".format(str(sol)), timestamp=True)
-                conn_worker.send(sol)
+                sol = engine.best(chair_weights)
+                log.write(log_path, "Sending best solution for chair to server.", timestamp=True)
+                with timers.time("ipc"):
+                    conn_worker.send(sol)
+            conn_worker.send(("stats", timers.summary()))
 
+            if recorder is not None:
+                recorder.tour(tsprecord.RESULT, sol, count, instance.generations_completed, tsp.total(distance_table, sol), tsp.total(time_table, sol), tsp.fitness(problem, sol))
+                recorder.flush()
+
+            log.write(log_path, tsp.tour_cache.stats(), timestamp=True)
             count += 1
 
-        #conn_worker.close()
\ No newline at end of file
+        #conn_worker.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs stakeholders for a server on another host.")
+    parser.add_argument("config", nargs="?", default="default.csv", help="client config file in client_configs")
+    parser.add_argument("--host", default="localhost", help="the server's address")
+    parser.add_argument("--port", type=int, default=6000, help="the server's port")
+    parser.add_argument("--authkey", default=None, help="the server's authkey")
+    parser.add_argument("--pop-multiplier", type=int, default=1, help="how many times to duplicate each config")
+    parser.add_argument("--log-dir", default=None, help="directory to save the log files")
+    parser.add_argument("--seed", type=int, default=None, help="seed for the stakeholders' random choices")
+    args = parser.parse_args()
+
+    authkey = None
+    if args.authkey is not None:
+        authkey = args.authkey.encode()
+
+    if args.log_dir is not None:
+        os.makedirs(args.log_dir, exist_ok=True)
+
+    client_list = load(args.config, args.pop_multiplier, log_dir=args.log_dir, address=(args.host, args.port), authkey=authkey, seed=args.seed)
+
+    for c in client_list:
+        c.start()
+
+    for c in client_list:
+        c.join()
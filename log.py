@@ -6,8 +6,26 @@
 #
 # This file holds several helper functions used in logging.
 #
+# By default, messages are not written right away, but put on a queue which a
+# background thread writes out in batches, opening each file once per batch.
+# Everything still queued is written when the process exits.
+#
+#       configure(buffered = True, flush_interval = 1.0, max_bytes = None,
+#                 backup_count = 3, compress = False)
+# Changes how log files are written. Should be called before any processes are
+# started, so they all share the settings.
+#
+# PARAMETERS
+# buffered:       - if False, every message is written right away
+# flush_interval: - the most seconds a message waits before being written
+# max_bytes:      - if not None, a file is rotated once it reaches this size,
+#                   path.1 being the newest old file
+# backup_count:   - how many rotated files to keep
+# compress:       - if True, files are written gzipped, to path + ".gz"
+#
+#
 #       write(log_path, msg, timestamp = False, name = None)
-# This writes a message to a text file. 
+# This writes a message to a text file.
 #
 # PARAMETERS
 # log_path:  - the path to the log file.
@@ -16,6 +34,10 @@
 # name:      - if not None, the message will be prefixed with the name.
 #
 #
+#       create(log_path, msg = "")
+# This empties a text file (creating it if needed), then writes msg to it.
+#
+#
 #       hr(log_path)
 # This writes a horizontal rule to a text file.
 #
@@ -29,23 +51,177 @@
 # PARAMETERS
 # log_path:  - the path to the log file.
 # list:      - the list of strings to write.
+#
+#
+#       flush()
+# Waits until every queued message has been written.
+from multiprocessing import util
 from datetime import datetime as dt
+from threading import Event, Thread
+import atexit
+import queue
+import gzip
+import time
+import os
+
+buffered = True
+flush_interval = 1.0
+max_bytes = None
+backup_count = 3
+compress = False
+
+def configure(buffered = True, flush_interval = 1.0, max_bytes = None, backup_count = 3, compress = False):
+    flush()
+    globals().update(buffered=buffered,
+                     flush_interval=flush_interval,
+                     max_bytes=max_bytes,
+                     backup_count=backup_count,
+                     compress=compress)
+
+# returns the name of a log file, or of its nth rotated file
+def file_name(log_path, n = 0):
+    if n > 0:
+        log_path = "{}.{}".format(log_path, n)
+    if compress:
+        log_path += ".gz"
+    return log_path
+
+# moves path to path.1, path.1 to path.2, and so on
+def rotate(log_path):
+    for n in range(backup_count, 0, -1):
+        if os.path.exists(file_name(log_path, n-1)):
+            os.replace(file_name(log_path, n-1), file_name(log_path, n))
+
+# writes text to a file, with mode "a" to append to it or "w" to replace it
+def write_file(log_path, text, mode):
+    path = file_name(log_path)
+    if mode == "a" and max_bytes is not None and os.path.exists(path) and os.path.getsize(path) >= max_bytes:
+        rotate(log_path)
+
+    if compress:
+        with gzip.open(path, mode + "t") as f:
+            f.write(text)
+    else:
+        with open(path, mode) as f:
+            f.write(text)
+
+# the background thread that writes queued messages
+class Writer():
+    def __init__(self):
+        self.pid = os.getpid()
+        self.queue = queue.Queue()
+        self.closed = False
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def put(self, log_path, text, mode = "a"):
+        self.queue.put((log_path, text, mode))
+
+    # writes a batch, which maps each path to its mode and list of messages
+    def write_batch(self, batch):
+        for log_path, (mode, texts) in batch.items():
+            try:
+                write_file(log_path, "".join(texts), mode)
+            except:
+                if mode == "w":
+                    print("Fail to create file:", log_path)
+
+    def run(self):
+        batch = {}
+        deadline = None
+        while True:
+            timeout = None
+            if deadline is not None:
+                timeout = max(deadline - time.monotonic(), 0)
+
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if isinstance(item, tuple):
+                log_path, text, mode = item
+                if mode == "w" or log_path not in batch:
+                    batch[log_path] = [mode, []]
+                batch[log_path][1].append(text)
+                if deadline is None:
+                    deadline = time.monotonic() + flush_interval
+                if time.monotonic() < deadline:
+                    continue
+
+            self.write_batch(batch)
+            batch = {}
+            deadline = None
+
+            # flush() and close() send an Event, which is set once written
+            if isinstance(item, Event):
+                item.set()
+                if self.closed:
+                    return
+
+    def flush(self):
+        if self.thread.is_alive():
+            done = Event()
+            self.queue.put(done)
+            done.wait()
+
+    def close(self):
+        if not self.closed and self.thread.is_alive():
+            self.closed = True
+            self.flush()
+
+writer = None
+
+# returns this process's writer, starting one if needed, or None once it's
+# been closed at exit
+# a forked process gets a copy of its parent's writer, but not its thread
+def get_writer():
+    global writer
+    if writer is None or writer.pid != os.getpid():
+        writer = Writer()
+        atexit.register(writer.close)
+
+        # multiprocessing children don't run atexit, but do run these
+        util.Finalize(None, writer.close, exitpriority=100)
+    if writer.closed:
+        return None
+    return writer
+
+def flush():
+    if writer is not None and writer.pid == os.getpid():
+        writer.flush()
+
+# formats a message the same way for write and LogFile.write
+def line(msg, timestamp = False, name = None):
+    s = ""
+    if timestamp is not False:
+        s = s + dt.now().strftime("%y-%m-%d %H:%M:%S") + " "
+    if name is not None:
+        s = s + name + " "
+    return s + msg + "\n"
+
+def append(log_path, text, mode = "a"):
+    if log_path is None:
+        return
+    w = get_writer() if buffered else None
+    if w is not None:
+        w.put(log_path, text, mode)
+    else:
+        try:
+            write_file(log_path, text, mode)
+        except:
+            if mode == "w":
+                print("Fail to create file:", log_path)
 
 def write(log_path, msg, timestamp = False, name = None):
     try:
-        with open(log_path, 'a') as f:
-            s = ""
-            if timestamp is not False:
-                s = s + dt.now().strftime("%y-%m-%d %H:%M:%S") + " "
-            if name is not None:
-                s = s + name + " "
-            s = s + msg + "\n"
-
-            f.write(s)
-            f.close()
+        append(log_path, line(msg, timestamp, name))
     except:
         pass
 
+def create(log_path, msg = ""):
+    append(log_path, msg, "w")
+
 def hr(log_path):
     write(log_path, "----------------------------------------")
 
@@ -55,29 +231,14 @@ def write_csv(log_path, list):
 class LogFile:
     def __init__(self, log_path):
         self.log_path = log_path
-        try:
-            f = open(self.log_path, 'w')
-        except:
-            print("Fail to create file:", self.log_path)
-    
+        create(self.log_path)
+
     def write(self, msg, timestamp = False, name = None):
-        try:
-            with open(self.log_path, 'a') as f:
-                s = ""
-                if timestamp is not False:
-                    s = s + dt.now().strftime("%y-%m-%d %H:%M:%S") + " "
-                if name is not None:
-                    s = s + name + " "
-                s = s + msg + "\n"
-
-                f.write(s)
-                f.close()
-        except:
-            pass
+        write(self.log_path, msg, timestamp, name)
 
     def hr(self):
         self.write("----------------------------------------")
 
 class CSVLogFile(LogFile):
     def write(self, list):
-        LogFile.write(self, ",".join(list))
\ No newline at end of file
+        LogFile.write(self, ",".join(list))
@@ -13,13 +13,57 @@
 #
 # If a configuration file is not found, then the program will default to a
 # problem of size 20.
+#
+# Some settings can also be given on the command line, taking the place of the
+# config's, so the same config can be run several times at once (see batch.py):
+#   python stake.py comp --port 6001 --log-dir logs/comp-1 --seed 1
+# runs comp.csv on port 6001, saving the logs to logs/comp-1 instead of a new
+# directory named after the time. --client-config picks another client config,
+# and --headless turns on the headless column.
+#
+# The server configuration may also have these optional columns:
+#   server_mode:    "sync" (tspserver, the default) or "async" (tspasyncserver)
+#   shared_tables:  TRUE to send the lookup tables through shared memory (only
+#                   for clients on the same machine)
+#   address:        the address the server listens on (default "localhost", use
+#                   "0.0.0.0" to accept stakeholders from other hosts)
+#   port:           the port the server listens on (default 6000)
+#   authkey:        a shared secret clients must know to connect (default none)
+#   local_clients:  FALSE to not start any clients on this machine
+#   remote_clients: the number of extra stakeholders to wait for, started on
+#                   other hosts with client.py (default 0)
+#   log_max_bytes:  the size at which log files are rotated (default never)
+#   log_compress:   TRUE to gzip the log files
+#   neighbors:      how many nearest cities the server finds for each city, sent
+#                   to the stakeholders for their local search (default 16)
+#   adaptive_rounds:
+#                   TRUE to end rounds early once the stakeholders stagnate, or
+#                   extend them while they improve (see tspserver.RoundScheduler)
+#   stagnation_generations, min_wait, max_wait, time_budget:
+#                   settings for adaptive rounds (defaults 50 generations, 1
+#                   second, twice wait_time, and no budget)
+#   migration:      TRUE to keep the GAs running and exchange solutions through
+#                   the server as they're found, instead of at the end of each
+#                   round (see tspserver.EliteArchive, sync server only)
+#   migration_interval:
+#                   the seconds between exchanges (default 1)
+#   seed:           the seed of the first stakeholder's random choices, each of
+#                   the others getting the next (see client.load) (default none)
+#   headless:       TRUE to only save the plot of the best solution, instead of
+#                   also showing it, which waits for its window to be closed
+#   snapshots:      TRUE to plot the best solution of every round while the
+#                   search runs, to Rounds/ in the log directory, and animate
+#                   them into Convergence.gif at the end (see tspplot.py)
 from multiprocessing.connection import Pipe
 from datetime import datetime as dt
 from multiprocessing import Process
+import tspasyncserver
 import tspserver
+import tspplot
+import argparse
 import pandas
 import client
-import sys
+import log
 import tsp
 import os
 
@@ -30,13 +74,40 @@ wait_time = 60
 num_rounds = 60
 pop_multiplier = 1
 num_top_solutions = 3
+server_mode = "sync"
+shared_tables = False
+address = "localhost"
+port = 6000
+authkey = None
+local_clients = True
+remote_clients = 0
+log_max_bytes = None
+log_compress = False
+neighbors = 16
+adaptive_rounds = False
+stagnation_generations = 50
+min_wait = 1
+max_wait = None
+time_budget = None
+migration = False
+migration_interval = 1
+seed = None
+headless = False
+snapshots = False
 
 if __name__ == "__main__":
 
-    try:
-        server_config = sys.argv[1] + ".csv"
-    except:
-        pass
+    parser = argparse.ArgumentParser(description="Runs the stakeholder search.")
+    parser.add_argument("config", nargs="?", default=None, help="server config file in server_configs, without .csv")
+    parser.add_argument("--client-config", default=None, help="client config file in client_configs, instead of the server config's")
+    parser.add_argument("--port", type=int, default=None, help="the port the server listens on, instead of the config's")
+    parser.add_argument("--log-dir", default=None, help="directory to save the log files")
+    parser.add_argument("--seed", type=int, default=None, help="seed for the stakeholders' random choices")
+    parser.add_argument("--headless", action="store_true", help="save the plot of the best solution without showing it")
+    args = parser.parse_args()
+
+    if args.config is not None:
+        server_config = args.config + ".csv"
 
     server_config = os.path.join("server_configs", server_config)
     server_config = pandas.read_csv(server_config)
@@ -51,9 +122,62 @@ if __name__ == "__main__":
     except:
         pass
 
+    server_mode = client.option(server_config, 0, "server_mode", server_mode)
+    shared_tables = bool(client.option(server_config, 0, "shared_tables", shared_tables))
+    address = client.option(server_config, 0, "address", address)
+    port = int(client.option(server_config, 0, "port", port))
+    authkey = client.option(server_config, 0, "authkey", authkey)
+    local_clients = bool(client.option(server_config, 0, "local_clients", local_clients))
+    remote_clients = int(client.option(server_config, 0, "remote_clients", remote_clients))
+    log_max_bytes = client.option(server_config, 0, "log_max_bytes", log_max_bytes)
+    log_compress = bool(client.option(server_config, 0, "log_compress", log_compress))
+    neighbors = int(client.option(server_config, 0, "neighbors", neighbors))
+    adaptive_rounds = bool(client.option(server_config, 0, "adaptive_rounds", adaptive_rounds))
+    stagnation_generations = int(client.option(server_config, 0, "stagnation_generations", stagnation_generations))
+    min_wait = float(client.option(server_config, 0, "min_wait", min_wait))
+    max_wait = client.option(server_config, 0, "max_wait", max_wait)
+    time_budget = client.option(server_config, 0, "time_budget", time_budget)
+    migration = bool(client.option(server_config, 0, "migration", migration))
+    migration_interval = float(client.option(server_config, 0, "migration_interval", migration_interval))
+    seed = client.option(server_config, 0, "seed", seed)
+    headless = bool(client.option(server_config, 0, "headless", headless)) or args.headless
+    snapshots = bool(client.option(server_config, 0, "snapshots", snapshots))
+
+    if args.client_config is not None:
+        client_config = args.client_config
+    if args.port is not None:
+        port = args.port
+    if args.seed is not None:
+        seed = args.seed
+    if seed is not None:
+        seed = int(seed)
+
+    if max_wait is not None:
+        max_wait = float(max_wait)
+    if time_budget is not None:
+        time_budget = float(time_budget)
+
+    if log_max_bytes is not None:
+        log_max_bytes = int(log_max_bytes)
+
+    # set before any processes are started, so they all log the same way
+    log.configure(max_bytes=log_max_bytes, compress=log_compress)
+
+    if authkey is not None:
+        authkey = str(authkey).encode()
+
+    # local clients can't connect to the wildcard address
+    client_address = address
+    if address in ["", "0.0.0.0"]:
+        client_address = "localhost"
+
     problem_path = os.path.join("problems", filename)
-    log_dir = os.path.join("logs", dt.now().strftime("%Y-%m-%d-%H-%M-%S"))
-    os.mkdir(log_dir)
+    if args.log_dir is not None:
+        log_dir = args.log_dir
+        os.makedirs(log_dir, exist_ok=True)
+    else:
+        log_dir = os.path.join("logs", dt.now().strftime("%Y-%m-%d-%H-%M-%S"))
+        os.mkdir(log_dir)
     
     problem = pandas.read_csv(problem_path, index_col=0)
 
@@ -64,19 +188,49 @@ if __name__ == "__main__":
     print("Num Rounds:    ", num_rounds)
     print("Pop Multiplier:", pop_multiplier)
     print("Num Top Solutions:", num_top_solutions)
+    print("Server Mode:   ", server_mode)
+    print("Shared Tables: ", shared_tables)
+    print("Address:       ", address, port)
+    print("Remote Clients:", remote_clients)
+    print("Adaptive Rounds:", adaptive_rounds)
+    print("Seed:          ", seed)
+    print("Headless:      ", headless)
     print()
 
     sol_pipe, server_pipe = Pipe()
         
-    client_list = client.load(client_config, pop_multiplier, log_dir=log_dir)
+    client_list = []
+    if local_clients:
+        client_list = client.load(client_config, pop_multiplier, log_dir=log_dir, address=(client_address, port), authkey=authkey, seed=seed)
 
-    server = Process(target=tspserver.server_func, 
-                    args=[problem, len(client_list)], 
+    # the rounds are plotted in the background, while the search runs
+    snapshot_plots = None
+    if snapshots:
+        snapshot_plots = tspplot.Snapshots(problem, os.path.join(log_dir, "Rounds"))
+
+    server_target = tspserver.server_func
+    if server_mode == "async":
+        server_target = tspasyncserver.async_server_func
+
+    server = Process(target=server_target, 
+                    args=[problem, len(client_list) + remote_clients], 
                     kwargs={"pipe": server_pipe, 
                             "wait_time": wait_time, 
                             "num_rounds": num_rounds, 
                             "log_dir": log_dir, 
-                            "num_top_solutions": num_top_solutions},
+                            "num_top_solutions": num_top_solutions,
+                            "shared_tables": shared_tables,
+                            "address": (address, port),
+                            "authkey": authkey,
+                            "neighbors": neighbors,
+                            "adaptive_rounds": adaptive_rounds,
+                            "stagnation_generations": stagnation_generations,
+                            "min_wait": min_wait,
+                            "max_wait": max_wait,
+                            "time_budget": time_budget,
+                            "migration": migration,
+                            "migration_interval": migration_interval,
+                            "snapshots": None if snapshot_plots is None else snapshot_plots.queue},
                     daemon=True)
     
     server.start()
@@ -90,6 +244,12 @@ if __name__ == "__main__":
         client.join()
 
     best_solution, winner_name = sol_pipe.recv()
-    tsp.plot_solution(problem,best_solution,save_path=os.path.join(log_dir, "Solution.png"),name=winner_name)
     sol_pipe.close()
+
+    if snapshot_plots is not None:
+        frames = snapshot_plots.close()
+        if tspplot.animate(frames, os.path.join(log_dir, "Convergence.gif")) is not None:
+            print(dt.now(), "Saved {} rounds to {}".format(len(frames), os.path.join(log_dir, "Convergence.gif")))
+
+    tsp.plot_solution(problem,best_solution,save_path=os.path.join(log_dir, "Solution.png"),name=winner_name,show=not headless)
     
\ No newline at end of file
@@ -0,0 +1,73 @@
+################################################################################
+# TRAVELING SALESMAN PROBLEM - COMMITTEE TESTS
+#
+# Checks that the server's Committee carries on when a stakeholder goes away
+# between rounds, and sums the phase summaries it's sent. Run with:
+#   python -m pytest tests
+import os
+import sys
+import time
+import unittest
+import numpy as np
+from multiprocessing.connection import Listener, Client
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from tspserver import Committee
+
+class TestCommittee(unittest.TestCase):
+    def setUp(self):
+        table = np.ones((5, 5))
+        self.committee = Committee(table, table)
+        self.listener = Listener(("localhost", 0))
+        self.clients = []
+        for name in ["A", "B"]:
+            self.clients.append(Client(self.listener.address))
+            self.committee.add(self.listener.accept(), name)
+
+    def tearDown(self):
+        for conn in self.clients:
+            conn.close()
+        self.committee.close_all()
+        self.listener.close()
+
+    def test_round_after_disconnect(self):
+        a, b = self.clients
+        tour = np.arange(1, 6)
+
+        # round 0, both answer
+        a.send(tour)
+        b.send(tour[::-1].copy())
+        self.committee.recv_from_all()
+        solutions = self.committee.find_top_solutions(self.committee.distance_table)
+
+        # B goes away before round 1
+        b.close()
+        time.sleep(0.1)
+        for i in range(0, 3):
+            self.committee.send_solutions(solutions)
+            a.send(np.roll(tour, i))
+            self.committee.recv_from_all()
+            self.committee.recv_status(0.1)
+
+        stakeholders = self.committee.stakeholder_list
+        self.assertTrue(stakeholders[0].connected)
+        self.assertFalse(stakeholders[1].connected)
+        self.assertTrue(np.array_equal(stakeholders[0].last_result, np.roll(tour, 2)))
+        self.assertEqual(self.committee.send_to_all("stop"), [stakeholders[0]])
+
+    # migrating stakeholders send a summary every migration interval
+    def test_stats_are_summed(self):
+        a = self.clients[0]
+        stakeholder = self.committee.stakeholder_list[0]
+        a.send(("stats", {"ga": [1.0, 1], "on_generation": [0.5, 10]}))
+        a.send(("stats", {"ga": [2.0, 1], "fitness": [0.25, 4]}))
+        a.send(np.arange(1, 6))
+        self.committee.recv_migrants(self.committee.archive, self.committee.distance_table, 0.5)
+
+        self.assertEqual(stakeholder.stats, {"ga": [3.0, 2], "on_generation": [0.5, 10], "fitness": [0.25, 4]})
+        self.committee.csv_header()
+        self.committee.find_top_solutions(self.committee.distance_table)
+        self.assertEqual(self.committee.csv_solutions(1, self.committee.distance_table)[5], "10")
+
+if __name__ == "__main__":
+    unittest.main()
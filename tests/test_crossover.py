@@ -0,0 +1,81 @@
+################################################################################
+# TRAVELING SALESMAN PROBLEM - CROSSOVER TESTS
+#
+# Checks that tspga's cascade_crossover, rewritten around each parent's inverse
+# permutation, makes exactly the same offspring as the operator it replaced for
+# the same seed. Run with:
+#   python -m pytest tests
+import os
+import sys
+import random
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from tspga import create_tspga
+
+# the operator before the rewrite, copied as it was
+def contains_duplicates(x):
+    return len(np.unique(x)) != len(x)
+
+def old_cascade_crossover(parents, offspring_size, ga_instance):
+    offspring = []
+    N = len(parents) - 1
+    while len(offspring) != offspring_size[0]:
+        p1 = random.randint(0,N) #index of parent 1
+        p2 = random.randint(0,N) #index of parent 2
+
+        while p2 == p1:
+            p2 = random.randint(0,N)
+
+        child = parents[p1].copy()
+
+        swap_index = random.randint(0,N)
+        child[swap_index] = parents[p2][swap_index]
+
+        # if the swap creates a duplicate gene,
+        # continues to swap genes until all duplicates have been eliminated
+        while (contains_duplicates(child)):
+            swap_index = np.where(parents[p1]==child[swap_index])
+            child[swap_index] = parents[p2][swap_index]
+
+        offspring.append(child)
+    return np.array(offspring)
+
+# returns the crossover create_tspga gives the GA, for a problem of N cities
+def new_cascade_crossover(N):
+    table = np.random.default_rng(0).random((N, N))
+    instance = create_tspga(table, table, table, population=random_parents(N, 10), log_generations="off", engine="native")
+    return instance.crossover_func
+
+def random_parents(N, count):
+    return np.argsort(np.random.default_rng(N * count).random((count, N)), axis=1) + 1
+
+class TestCascadeCrossover(unittest.TestCase):
+    # (cities, parents, offspring)
+    CASES = [(10, 2, 8), (20, 5, 15), (20, 20, 40), (100, 50, 150), (500, 250, 200)]
+
+    def test_same_offspring_as_old_operator(self):
+        for N, count, size in self.CASES:
+            parents = random_parents(N, count)
+            crossover = new_cascade_crossover(N)
+            for seed in range(0, 5):
+                random.seed(seed)
+                np.random.seed(seed)
+                expected = old_cascade_crossover(parents.copy(), (size, N), None)
+
+                random.seed(seed)
+                np.random.seed(seed)
+                offspring = crossover(parents.copy(), (size, N), None)
+
+                np.testing.assert_array_equal(offspring, expected, "N={} parents={} seed={}".format(N, count, seed))
+
+    def test_offspring_are_permutations(self):
+        N = 100
+        parents = random_parents(N, 50)
+        random.seed(1)
+        offspring = new_cascade_crossover(N)(parents, (200, N), None)
+        np.testing.assert_array_equal(np.sort(offspring, axis=1), np.tile(np.arange(1, N+1), (200, 1)))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -25,36 +25,82 @@
 #       load(filename)
 # Loads a TSP from a given file, returning a pandas dataframe.
 #
-#       create_lookup_tables(tsp)
+#       create_lookup_tables(tsp, dtype = np.float64, chunk_size = None)
 # Creates four lookup tables from a given TSP, returning them as a tuple. The
 # return values are:
 #   distance_table: a table of distances between each pair of cities
 #   time_table: a table of times between each pair of cities
 #   distance_norm: a table of normalized distances between each pair of cities
 #   time_norm: a table of normalized times between each pair of cities
+# The tables are stored as the given dtype (np.float32 halves the memory used).
+# If chunk_size is given, the tables are built chunk_size rows at a time, which
+# keeps the temporary memory fixed for very large problems.
+#
+#       create_neighbor_index(tsp, K = 16)
+# Returns the K nearest cities to each city, by the x and y coordinates, as an
+# N x K array of table indices (city - 1), nearest first. The cities are put in
+# a grid, so only the cells around each city are searched, instead of all N.
 #
 #       create_weighted_table(distance_weight, time_weight, 
 #                               distance_table, time_table)
 # Creates a single table using the given weights and lookup tables.
 #
-#       total(lookup_table, solution)
-# Totals the cost of a solution, given a lookup table.
+#       total(lookup_table, solution, cached = True)
+# Totals the cost of a solution, given a lookup table. Unless cached is False,
+# tours of at least tour_cache.min_cities are looked up in (and saved to)
+# tour_cache. Below that, summing the tour is about as quick as a lookup.
 #
 #       fitness(lookup_table, solution)
 # Returns the fitness of a solution, given a lookup table.
 #
+#       total_batch(lookup_table, population)
+# Totals the cost of every solution in a population (a 2D array, one solution
+# per row) at once. Gives the same values as total.
+#
+#       fitness_batch(lookup_table, population)
+# Returns the fitness of every solution in a population at once.
+#
 #       best(population, lookup_table)
 # Returns the best solution in a population.
 #
-#       plot_solution(tsp, solution, save_path = None, name = None)
-# Plots and shows a solution using matplotlib.
+#       TourCache(maxsize = 8192, max_tables = 32, min_cities = 20)
+# A bounded LRU cache of tour costs, keyed by the lookup table and a hash of the
+# tour's exact cities, so a cached cost is always the one total would find for
+# that tour. The module-level instance tour_cache is used by total, fitness and
+# best, for tours of at least min_cities.
+#
+# METHODS
+# tour_key(solution, symmetric = True) - returns a hash of a tour which is the
+#                                       same for its rotations (and reversals,
+#                                       if symmetric), for telling tours apart
+# total(lookup_table, solution)       - returns the cost of a tour, computing 
+#                                       it only on a cache miss
+# clear()                             - empties the cache and resets counters
+# stats()                             - returns the hit/miss counts as a string
+#
+#       plot_solution(tsp, solution, save_path = None, name = None, 
+#                     show = True)
+# Plots and shows a solution using matplotlib. If show is False, it's only 
+# saved, with render_solution.
+#
+#       render_solution(tsp, solution, save_path, name = None, size = 8,
+#                       dpi = 100)
+# Saves a plot of a solution with the Agg backend, never opening a window.
+#
+#       draw_solution(ax, tsp, solution, name = None)
+# Draws a solution on a set of matplotlib axes, the cities as points coloured by
+# their time cost (the terrain column), and the tour as arrows between them.
 #
 #       pop_string(population)
 # Returns a string representation of a population, for debugging/logging.
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 import matplotlib.pyplot as plt
 import pandas as pd
+from collections import OrderedDict
+from threading import Lock
 import numpy as np
-import math
+import hashlib
 import sys
 
 # generates a travelling salesman problem and saves it to a csv file
@@ -81,30 +127,100 @@ def load(filename):
 
 # returns four lookup tables created from the given problem
 # distance_table, time_table, distance_norm, time_norm
-def create_lookup_tables(tsp):
+def create_lookup_tables(tsp, dtype=np.float64, chunk_size=None):
+    tsp = tsp.to_numpy(dtype=np.float64)
+    length = int(tsp.size / 3)
 
-    # does this return correctly?
-    def distance(a,b):
-        return math.sqrt((tsp[a,0]-tsp[b,0])**2 + (tsp[a,1]-tsp[b,1])**2)
+    if chunk_size is None or chunk_size > length:
+        chunk_size = length
+    chunk_size = max(chunk_size, 1)
 
-    def time(a,b):
-        return distance(a,b) * tsp[a,2] * tsp[b,2]
-        
-    tsp = tsp.to_numpy()
-    length = int(tsp.size / 3)
-    lookup_table = np.zeros((length, length))
-    lookup_table_time = np.zeros((length,length))
-    
-    for i in range(0,length):
-        for j in range(0,length):
-            lookup_table[i, j] = lookup_table[j, i] = distance(i,j)
-            lookup_table_time[i, j] = lookup_table_time[j, i] = time(i,j)
-    
-    distance_norm = lookup_table/np.linalg.norm(lookup_table, axis=1)
-    time_norm = lookup_table_time/np.linalg.norm(lookup_table_time, axis=1)
+    x = tsp[:,0]
+    y = tsp[:,1]
+    terrain = tsp[:,2]
+    columns = np.arange(length)
+
+    lookup_table = np.empty((length, length), dtype=dtype)
+    lookup_table_time = np.empty((length, length), dtype=dtype)
+    distance_row_norm = np.empty(length)
+    time_row_norm = np.empty(length)
+
+    # builds the tables a block of rows at a time, so the temporaries never
+    # grow past chunk_size x length
+    for start in range(0, length, chunk_size):
+        stop = min(start + chunk_size, length)
+        rows = np.arange(start, stop)[:, None]
+
+        distance = np.sqrt((x[rows] - x)**2 + (y[rows] - y)**2)
+
+        # terrain is multiplied in the same order as the old loop did, so the
+        # tables match it exactly
+        time = distance * terrain[np.maximum(rows, columns)] * terrain[np.minimum(rows, columns)]
+
+        lookup_table[start:stop] = distance
+        lookup_table_time[start:stop] = time
+        distance_row_norm[start:stop] = np.linalg.norm(distance, axis=1)
+        time_row_norm[start:stop] = np.linalg.norm(time, axis=1)
+
+    distance_norm = np.empty((length, length), dtype=dtype)
+    time_norm = np.empty((length, length), dtype=dtype)
+
+    for start in range(0, length, chunk_size):
+        stop = min(start + chunk_size, length)
+        distance_norm[start:stop] = lookup_table[start:stop] / distance_row_norm
+        time_norm[start:stop] = lookup_table_time[start:stop] / time_row_norm
 
     return lookup_table, lookup_table_time, distance_norm, time_norm
 
+# returns the K nearest neighbors of every city, found with a grid
+def create_neighbor_index(tsp, K = 16):
+    xy = tsp.to_numpy(dtype=np.float64)[:, :2]
+    length = len(xy)
+    K = max(min(K, length - 1), 0)
+    neighbors = np.empty((length, K), dtype=np.int32)
+    if K == 0:
+        return neighbors
+
+    # about K cities to a cell
+    side = max(int(np.sqrt(length / K)), 1)
+    low = xy.min(axis=0)
+    size = max(np.ptp(xy, axis=0).max() / side, np.finfo(np.float64).tiny)
+    cells = np.minimum(((xy - low) / size).astype(int), side - 1)
+    cell_ids = cells[:, 0] * side + cells[:, 1]
+
+    # the cities sorted by cell, so each row of cells is a single slice
+    order = np.argsort(cell_ids, kind="stable")
+    starts = np.searchsorted(cell_ids[order], np.arange(side * side + 1))
+
+    for cx in range(0, side):
+        for cy in range(0, side):
+            members = order[starts[cx*side + cy]:starts[cx*side + cy + 1]]
+            if len(members) == 0:
+                continue
+
+            # searches a growing square of cells around this one
+            # any city outside a square r cells out is at least r*size away
+            r = 1
+            while True:
+                x0, x1 = max(cx - r, 0), min(cx + r, side - 1)
+                y0, y1 = max(cy - r, 0), min(cy + r, side - 1)
+                candidates = np.concatenate([order[starts[x*side + y0]:starts[x*side + y1 + 1]] for x in range(x0, x1 + 1)])
+                everything = x0 == 0 and y0 == 0 and x1 == side - 1 and y1 == side - 1
+
+                if len(candidates) > K:
+                    distance = np.sqrt(((xy[members, None, :] - xy[None, candidates, :])**2).sum(axis=2))
+                    distance[members[:, None] == candidates[None, :]] = np.inf
+                    nearest = np.argpartition(distance, K - 1, axis=1)[:, :K]
+                    nearest_distance = np.take_along_axis(distance, nearest, axis=1)
+
+                    if everything or nearest_distance.max() <= r * size:
+                        sort = np.argsort(nearest_distance, axis=1, kind="stable")
+                        neighbors[members] = candidates[np.take_along_axis(nearest, sort, axis=1)]
+                        break
+                r += 1
+
+    return neighbors
+
 # creates a single table out of the given weights and lookup tables
 def create_weighted_table(distance_weight, time_weight, distance_table, time_table):
     dist_norm = distance_table*distance_weight
@@ -112,7 +228,10 @@ def create_weighted_table(distance_weight, time_weight, distance_table, time_tab
     return dist_norm+time_norm
 
 # returns the total distance of a given solution
-def total(lookup_table, sol):
+def total(lookup_table, sol, cached = True):
+    if cached and len(sol) >= tour_cache.min_cities:
+        return tour_cache.total(lookup_table, sol)
+
     N = len(sol)-1
     total = 0
 
@@ -125,62 +244,142 @@ def total(lookup_table, sol):
 def fitness(lookup_table,solution):
     return 1 / total(lookup_table, solution)
 
+# returns the total distance of every solution in a population
+def total_batch(lookup_table, population):
+    population = np.asarray(population, dtype=int) - 1
+    edges = lookup_table[population, np.roll(population, -1, axis=1)]
+
+    # cumsum adds the edges up in the same order as total, so the values match
+    return np.cumsum(edges, axis=1)[:, -1]
+
+# determines the fitness of every solution in a population
+def fitness_batch(lookup_table, population):
+    return 1 / total_batch(lookup_table, population)
+
 # returns the best solution in a population
 def best(population, lookup_table):
     best = population[0]
+    best_fitness = fitness(lookup_table, best)
     for i in range(1,len(population)):
-        if fitness(lookup_table, population[i]) > fitness(lookup_table, best):
+        current_fitness = fitness(lookup_table, population[i])
+        if current_fitness > best_fitness:
             best = population[i]
+            best_fitness = current_fitness
     return best
 
-# plots a given solution
-def plot_solution(tsp, solution, save_path = None, name = None):
+# an LRU cache of tour costs, shared by everything in this process
+class TourCache():
+    def __init__(self, maxsize = 8192, max_tables = 32, min_cities = 20):
+        self.maxsize = maxsize
+        self.max_tables = max_tables
+        self.min_cities = min_cities
+        self.hits = 0
+        self.misses = 0
+        self.costs = OrderedDict()
+        self.tables = OrderedDict()
+        self.next_token = 0
+        self.lock = Lock()
 
-    plt.rcParams['figure.figsize'] = [8, 8]
+    # returns a hash of the tour which is the same for all of its rotations
+    # (and reversals, if symmetric is True)
+    def tour_key(self, solution, symmetric = True):
+        solution = np.asarray(solution, dtype=np.int64)
+        solution = np.roll(solution, -int(np.argmin(solution)))
+        if symmetric and len(solution) > 2 and solution[-1] < solution[1]:
+            solution = np.concatenate((solution[:1], solution[:0:-1]))
+        return hashlib.blake2b(solution.tobytes(), digest_size=16).digest()
 
-    x = []
-    y = []
-    for i in range(0,len(solution)):
-        x.append(tsp.loc[solution[i]][0])
-        y.append(tsp.loc[solution[i]][1])
-    
-    x.append(tsp.loc[solution[0]][0])
-    y.append(tsp.loc[solution[0]][1])
-    plt.ylabel("Position (y)")
-    plt.xlabel("Position (x)")
+    # returns a token for a lookup table
+    # tables are kept referenced while registered, so their ids can't be reused
+    def register_table(self, lookup_table):
+        entry = self.tables.get(id(lookup_table))
+        if entry is None or entry[0] is not lookup_table:
+            entry = (lookup_table, self.next_token)
+            self.next_token += 1
+            self.tables[id(lookup_table)] = entry
+            if len(self.tables) > self.max_tables:
+                self.tables.popitem(last=False)
+        else:
+            self.tables.move_to_end(id(lookup_table))
+        return entry[1]
 
-    green = None
-    blue = None
-    red = None
+    # returns the total cost of a tour, computing it only on a cache miss
+    # the key is the tour as given, since a rotation adds its edges up in
+    # another order, which can change the last bits of the sum
+    def total(self, lookup_table, solution):
+        key = hashlib.blake2b(np.asarray(solution, dtype=np.int64).tobytes(), digest_size=16).digest()
+        with self.lock:
+            key = (self.register_table(lookup_table), key)
+            cost = self.costs.get(key)
+            if cost is not None:
+                self.costs.move_to_end(key)
+                self.hits += 1
+                return cost
+            self.misses += 1
 
-    for i in range(0,len(x)-1):
-        terrain = tsp.loc[solution[i]][2]
+        cost = total(lookup_table, solution, cached=False)
 
-        if terrain < 1:
-            green = plt.plot(x[i], y[i], marker="o", color="green")
-        else:
-            if terrain > 1.5:
-                red = plt.plot(x[i], y[i], marker="o", color="red")
-            else:
-                blue = plt.plot(x[i], y[i], marker="o", color="blue")
-        if name is not None:
-            plt.suptitle(name)
-
-        plt.arrow(  x[i], 
-                    y[i], 
-                    (x[i+1] - x[i]), 
-                    (y[i+1] - y[i]),
-                    length_includes_head=True
-                    )
-
-    plt.legend(
-        title="Time Cost (t)",
-        handles=[green[0], blue[0], red[0]],
-        labels=["t < 1.0", "1.0 <= t <= 1.5", "1.5 < t"]
-        )
+        with self.lock:
+            self.costs[key] = cost
+            if len(self.costs) > self.maxsize:
+                self.costs.popitem(last=False)
+        return cost
+
+    # empties the cache
+    def clear(self):
+        with self.lock:
+            self.costs.clear()
+            self.tables.clear()
+            self.hits = 0
+            self.misses = 0
+
+    # returns the hit and miss counts as a string
+    def stats(self):
+        lookups = self.hits + self.misses
+        rate = 0 if lookups == 0 else self.hits / lookups
+        return "Tour cache: {} hits, {} misses ({:.1%} hit rate), {} entries".format(self.hits, self.misses, rate, len(self.costs))
+
+tour_cache = TourCache()
+
+# draws a solution on a set of axes, the tour as a single quiver of arrows
+def draw_solution(ax, tsp, solution, name = None):
+    x, y, terrain = tsp.loc[np.asarray(solution)].to_numpy()[:, :3].T
+    ax.quiver(x, y, np.roll(x, -1) - x, np.roll(y, -1) - y, 
+              angles="xy", scale_units="xy", scale=1, width=0.0015)
+
+    # the cities are coloured by their time cost
+    groups = [(terrain < 1, "green", "t < 1.0"),
+              ((terrain >= 1) & (terrain <= 1.5), "blue", "1.0 <= t <= 1.5"),
+              (terrain > 1.5, "red", "1.5 < t")]
+    for group, color, label in groups:
+        ax.scatter(x[group], y[group], color=color, label=label, zorder=2)
+
+    ax.set_ylabel("Position (y)")
+    ax.set_xlabel("Position (x)")
+    ax.legend(title="Time Cost (t)")
+    if name is not None:
+        ax.figure.suptitle(name)
+
+# saves a plot of a solution without pyplot, so it works without a display and
+# outside the main thread
+def render_solution(tsp, solution, save_path, name = None, size = 8, dpi = 100):
+    figure = Figure(figsize=(size, size))
+    FigureCanvasAgg(figure)
+    draw_solution(figure.add_subplot(), tsp, solution, name)
+    figure.savefig(save_path, dpi=dpi)
+
+# plots a given solution
+def plot_solution(tsp, solution, save_path = None, name = None, show = True):
+    if not show:
+        if save_path is not None:
+            render_solution(tsp, solution, save_path, name)
+        return
+
+    figure = plt.figure(figsize=(8, 8))
+    draw_solution(figure.add_subplot(), tsp, solution, name)
 
     if save_path is not None:
-        plt.savefig(save_path)
+        figure.savefig(save_path)
 
     plt.show()
 
@@ -0,0 +1,399 @@
+################################################################################
+# TRAVELING SALESMAN PROBLEM - ASYNCIO SERVER
+# Olga Koldachenko          okold525@mtroyal.ca
+# COMP 5690                 Senior Computer Science Project
+# Mount Royal University    Winter 2022
+#
+# An alternative to tspserver.server_func which handles every stakeholder in
+# its own coroutine. Messages are broadcast and results gathered concurrently,
+# each stakeholder gets its own timeout so a slow one can't stall the round, and
+# stakeholders may join after the search has started.
+#
+# The wire format is the one used by multiprocessing.connection (a 4 byte
+# length followed by a pickle), so unmodified client.tsp_client processes can
+# connect to it.
+#
+#       AsyncStakeholder(reader, writer, name, distance_table, time_table)
+# A Stakeholder whose connection is an asyncio stream. THIS SHOULD NOT BE USED
+# ON ITS OWN, but rather created by the AsyncCommittee class.
+#
+# METHODS
+# send(frame, timeout)           - sends an encoded message
+# request_result(timeout)        - sends "req_result" and waits for the answer
+# request_status(timeout)        - sends "req_status" and waits for the answer
+# listen()                       - receives results and progress until the 
+#                                  connection closes
+#
+#
+#       AsyncCommittee(distance_table, time_table, recv_timeout = None)
+# A Committee whose stakeholders are served by coroutines. The ranking, printing
+# and CSV methods are inherited from tspserver.Committee.
+#
+# METHODS
+# handle_connection(reader, writer)        - the asyncio.start_server callback
+# wait_for_stakeholders(N, timeout = None) - waits until N stakeholders joined
+# broadcast(message)                       - sends a message to everyone
+# gather_results()                         - requests and receives all results
+# wait_for_round(scheduler)                - polls everyone's progress until
+#                                            the tspserver.RoundScheduler ends
+#                                            the round, returning why
+# close_all()                              - closes all connections
+#
+#
+#       async_server_func(problem, num_clients, wait_time = 5, num_rounds = 5,
+#                         pipe = None, distance_weight = 0.5, time_weight = 0.5,
+#                         address = ("localhost", 6000), num_top_solutions = 3,
+#                         log_dir = None, shared_tables = False,
+#                         authkey = None, neighbors = 16,
+#                         adaptive_rounds = False, stagnation_generations = 50,
+#                         min_wait = 1, max_wait = None, time_budget = None,
+#                         migration = False, migration_interval = 1,
+#                         recv_timeout = None, join_timeout = None,
+#                         snapshots = None)
+# The function to be passed to a Process object as the target. Takes the same
+# parameters as tspserver.server_func (except that authkey and migration aren't
+# supported, and binary tours are always turned down), plus:
+#
+#   PARAMETERS
+# recv_timeout:    - seconds to wait for each stakeholder's result, after which
+#                    its previous result is used (default wait_time)
+# join_timeout:    - seconds to wait for num_clients stakeholders to connect
+#                    before starting anyway (default None, waits forever)
+from datetime import datetime
+from tspserver import Stakeholder, Committee, RoundScheduler
+import asyncio
+import pickle
+import struct
+import time
+import tsprecord
+import tspshared
+import tspwire
+import log
+import os
+import tsp
+
+FRAME_HEADER = struct.Struct("!i")
+LARGE_FRAME_HEADER = struct.Struct("!Q")
+
+# returns a message framed the same way as multiprocessing.connection does
+# it's returned as a list of buffers, so large payloads aren't copied again
+def encode(message):
+    data = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    if len(data) > 0x7fffffff:
+        return [FRAME_HEADER.pack(-1) + LARGE_FRAME_HEADER.pack(len(data)), data]
+    return [FRAME_HEADER.pack(len(data)), data]
+
+# reads a single message from a stream
+async def read_message(reader):
+    size, = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+    if size == -1:
+        size, = LARGE_FRAME_HEADER.unpack(await reader.readexactly(LARGE_FRAME_HEADER.size))
+    return pickle.loads(await reader.readexactly(size))
+
+REQ_RESULT_FRAME = encode("req_result")
+REQ_STATUS_FRAME = encode("req_status")
+STOP_FRAME = encode("stop")
+
+# holds data for a single client connected through asyncio
+class AsyncStakeholder(Stakeholder):
+    def __init__(self, reader, writer, name, distance_table, time_table):
+        Stakeholder.__init__(self, None, name, distance_table, time_table)
+        self.reader = reader
+        self.writer = writer
+        self.pending = 0            # results requested but not yet received
+        self.replied = asyncio.Event()
+        self.replied.set()
+        self.status_replied = asyncio.Event()
+
+    # sends an encoded message, giving up after timeout seconds
+    async def send(self, frame, timeout = None):
+        if not self.connected:
+            return
+        try:
+            self.writer.writelines(frame)
+            await asyncio.wait_for(self.writer.drain(), timeout)
+        except asyncio.TimeoutError:
+            print(datetime.now(), self.name, "is slow to receive, continuing without it.")
+        except (ConnectionError, RuntimeError):
+            self.disconnect()
+
+    # requests the current result, waiting at most timeout seconds for it
+    # if it comes late, it's picked up by listen() for the next round
+    async def request_result(self, timeout = None):
+        if not self.connected:
+            return
+        self.pending += 1
+        self.replied.clear()
+        await self.send(REQ_RESULT_FRAME, timeout)
+        try:
+            await asyncio.wait_for(self.replied.wait(), timeout)
+        except asyncio.TimeoutError:
+            print(datetime.now(), self.name, "timed out, using its previous result.")
+
+    # asks for the GA's progress, waiting at most timeout seconds for it
+    async def request_status(self, timeout = None):
+        if not self.connected:
+            return
+        self.status_replied.clear()
+        await self.send(REQ_STATUS_FRAME, timeout)
+        try:
+            await asyncio.wait_for(self.status_replied.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    # receives results and progress until the connection is closed
+    async def listen(self):
+        try:
+            while True:
+                message = await read_message(self.reader)
+                if isinstance(message, tuple) and message[0] == "status":
+                    self.update_status(message[1], message[2])
+                    self.status_replied.set()
+                    continue
+                if isinstance(message, tuple) and message[0] == "stats":
+                    self.add_stats(message[1])
+                    continue
+
+                self.last_result = message
+                self.pending = max(self.pending - 1, 0)
+                if self.pending == 0:
+                    self.replied.set()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            self.disconnect()
+
+    def disconnect(self):
+        if self.connected:
+            print(datetime.now(), self.name, "disconnected.")
+        self.connected = False
+        self.replied.set()
+        self.status_replied.set()
+
+# a collection of stakeholders, each served by its own coroutine
+class AsyncCommittee(Committee):
+    def __init__(self, distance_table, time_table, recv_timeout = None):
+        Committee.__init__(self, distance_table, time_table)
+        self.recv_timeout = recv_timeout
+        self.init_frame = None      # sent again to stakeholders who join late
+        self.joined = asyncio.Event()
+
+    # serves a single stakeholder, from its name to the end of the connection
+    async def handle_connection(self, reader, writer):
+        try:
+            name, _, reply = tspwire.negotiate(await read_message(reader), False)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+
+        stakeholder = AsyncStakeholder(reader, writer, name, self.distance_table, self.time_table)
+        if reply is not None:   # always pickles, tour frames aren't supported here
+            await stakeholder.send(encode(reply), self.recv_timeout)
+        if self.init_frame is not None:
+            print(datetime.now(), name, "joined late, sending the problem.")
+            await stakeholder.send(self.init_frame, self.recv_timeout)
+
+        self.stakeholder_list.append(stakeholder)
+        self.max_name_length = max(self.max_name_length, len(name))
+        self.joined.set()
+
+        await stakeholder.listen()
+
+    # waits until N stakeholders have joined, or until timeout seconds passed
+    async def wait_for_stakeholders(self, N, timeout = None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while len(self.stakeholder_list) < N:
+            self.joined.clear()
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(self.joined.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+
+        if len(self.stakeholder_list) < N:
+            print(datetime.now(), "Starting with", len(self.stakeholder_list), "of", N, "stakeholders.")
+
+    # sends the same message to all clients at once
+    # the message is only pickled once
+    async def broadcast(self, message):
+        start = time.perf_counter()
+        frame = encode(message)
+        if message[0] == "init":
+            self.init_frame = frame
+        await asyncio.gather(*(s.send(frame, self.recv_timeout) for s in self.stakeholder_list))
+        self.timers.add("send_solutions" if message[0] == "continue" else "send_to_all", time.perf_counter() - start)
+
+    # requests data from all clients, then waits to receive it
+    async def gather_results(self):
+        start = time.perf_counter()
+        for s in self.stakeholder_list:
+            s.stats = None
+        await asyncio.gather(*(s.request_result(self.recv_timeout) for s in self.stakeholder_list))
+        self.timers.add("recv_from_all", time.perf_counter() - start)
+
+    # waits until the scheduler ends the round, polling everyone's progress
+    async def wait_for_round(self, scheduler):
+        while True:
+            await asyncio.sleep(max(min(scheduler.poll_interval, scheduler.round_length - scheduler.elapsed()), 0))
+            if scheduler.elapsed() < scheduler.round_length:
+                await asyncio.gather(*(s.request_status(scheduler.poll_interval) for s in self.stakeholder_list))
+            reason = scheduler.round_over(self.stakeholder_list)
+            if reason is not None:
+                return reason
+
+    # sends stop to all clients and closes the connections
+    async def close_all(self):
+        await asyncio.gather(*(s.send(STOP_FRAME, self.recv_timeout) for s in self.stakeholder_list))
+        for s in self.stakeholder_list:
+            s.connected = False
+            s.writer.close()
+
+        # lets every listen() see the end of its connection before returning
+        await asyncio.gather(*(s.writer.wait_closed() for s in self.stakeholder_list), return_exceptions=True)
+        await asyncio.sleep(0)
+
+async def run_server(problem, num_clients, wait_time, num_rounds, pipe,
+                     distance_weight, time_weight, address, num_top_solutions,
+                     log_dir, shared_tables, neighbors, scheduler, recv_timeout,
+                     join_timeout, snapshots):
+
+    csv_path = os.path.join(log_dir, "Server.csv")
+    csv = log.CSVLogFile(csv_path)
+    recorder = tsprecord.get(os.path.join(log_dir, "Server.rec"))
+    recorder.create()
+
+    distance_table, time_table, distance_norm, time_norm = tsp.create_lookup_tables(problem)
+    chair_weights = tsp.create_weighted_table(distance_weight, time_weight, distance_norm, time_norm)
+    neighbor_index = tsp.create_neighbor_index(problem, neighbors)
+
+    # publishes the tables once, and uses the shared copies from here on
+    shared = None
+    if shared_tables:
+        shared = tspshared.SharedTables([distance_norm, time_norm, distance_table, time_table, chair_weights, neighbor_index])
+        distance_norm, time_norm, distance_table, time_table, chair_weights, neighbor_index = shared.tables
+
+    if recv_timeout is None:
+        recv_timeout = wait_time
+
+    start_time = datetime.now()
+    c = AsyncCommittee(distance_table, time_table, recv_timeout)
+    server = await asyncio.start_server(c.handle_connection, address[0], address[1])
+
+    await c.wait_for_stakeholders(num_clients, join_timeout)
+    csv.write(c.csv_header())
+    c.record_names(recorder)
+
+    # rounds
+    top_solutions = []
+
+    for i in range(0, num_rounds):
+        if i > 0 and scheduler is not None and scheduler.out_of_time():
+            print()
+            print(datetime.now(), "Out of time, ending after", i, "rounds.")
+            break
+
+        print()
+        print(datetime.now(), "BEGINNING ROUND", i+1)
+        round_start = time.time()
+        round_cpu_time = time.process_time()
+        if scheduler is not None:
+            scheduler.begin_round(i, c.stakeholder_list)
+
+        # sends command/data to all clients
+        if i == 0:
+            init_message = ("init", distance_norm, time_norm, distance_table, time_table, chair_weights, neighbor_index)
+            if shared is not None:
+                init_message = ("init", shared.handle)
+            await c.broadcast(init_message)
+        else:
+            await c.broadcast(("continue", top_solutions))
+
+        wait_start = time.perf_counter()
+        if scheduler is None:
+            await asyncio.sleep(wait_time)
+        else:
+            reason = await c.wait_for_round(scheduler)
+            print(datetime.now(), "Ending round {} after {:.2f} seconds ({}).".format(i+1, scheduler.elapsed(), reason))
+        c.timers.add("wait", time.perf_counter() - wait_start)
+
+        # receives data from all clients
+        print(datetime.now(), "Receiving results...")
+        await c.gather_results()
+        c.print_all()
+
+        # records and prints the top solutions
+        top_solutions = c.find_top_solutions(chair_weights, N=num_top_solutions)
+
+        if num_top_solutions != len(c.stakeholder_list):
+            print()
+            print(datetime.now(), "Top solutions for round", i+1)
+            c.print_top()
+        csv.write(c.csv_solutions(i+1, chair_weights))
+        c.record_round(recorder, i+1, chair_weights)
+        if snapshots is not None:
+            c.queue_snapshot(snapshots, i+1, chair_weights)
+
+        print(datetime.now(), "Server CPU time for round {}: {:.4f} of {:.2f} seconds".format(i+1, time.process_time() - round_cpu_time, time.time() - round_start))
+
+    # sends stop command to all clients
+    server.close()
+    await c.close_all()
+    print()
+    print(datetime.now(), "Sent stop!")
+
+    # prints the best solution
+    print()
+    print(datetime.now(), "Best solution found:")
+    c.print_top(best=True)
+
+    total_time = (datetime.now() - start_time).total_seconds()
+    print(datetime.now(), "Total Time: {} seconds (expected {})".format(total_time, num_rounds * wait_time))
+    print(datetime.now(), tsp.tour_cache.stats())
+
+    # sends the best solution for drawing
+    if pipe != None:
+        solution, name = c.get_best_solution(chair_weights)
+        pipe.send((solution, "{} | D: {:.2f} | T: {:.2f} | F: {:.2f}".format(name, tsp.total(distance_table, solution), tsp.total(time_table, solution), tsp.fitness(chair_weights, solution))))
+        pipe.close()
+
+    if shared is not None:
+        shared.close()
+
+def async_server_func(problem,
+                      num_clients,
+                      wait_time = 5,
+                      num_rounds = 5,
+                      pipe = None,
+                      distance_weight = 0.5,
+                      time_weight = 0.5,
+                      address = ("localhost", 6000),
+                      num_top_solutions = 3,
+                      log_dir = None,
+                      shared_tables = False,
+                      authkey = None,
+                      neighbors = 16,
+                      adaptive_rounds = False,
+                      stagnation_generations = 50,
+                      min_wait = 1,
+                      max_wait = None,
+                      time_budget = None,
+                      migration = False,
+                      migration_interval = 1,
+                      recv_timeout = None,
+                      join_timeout = None,
+                      snapshots = None):
+
+    if authkey is not None:
+        raise ValueError("the asyncio server doesn't support authkeys, use tspserver.server_func")
+    if migration:
+        raise ValueError("the asyncio server doesn't support migration, use tspserver.server_func")
+
+    scheduler = None
+    if adaptive_rounds:
+        scheduler = RoundScheduler(wait_time, num_rounds, stagnation_generations, min_wait, max_wait, time_budget)
+
+    asyncio.run(run_server(problem, num_clients, wait_time, num_rounds, pipe,
+                           distance_weight, time_weight, address,
+                           num_top_solutions, log_dir, shared_tables,
+                           neighbors, scheduler, recv_timeout, join_timeout,
+                           snapshots))
@@ -6,8 +6,11 @@
 #
 #       create_tspga(lookup_table, distance_table, time_table, stop_ga, 
 #                       population, parent_selection_type, parents_kept, 
-#                       mutation_type, mutation_probability, log_path)
-# Returns a PyGAD instance for the traveling salesman problem.
+#                       mutation_type, mutation_probability, log_path,
+#                       recorder, round, log_generations, local_search,
+#                       local_search_every, neighbors, initial_population,
+#                       progress, migration, engine, timers)
+# Returns a PyGAD (or NativeGA) instance for the traveling salesman problem.
 #
 #   PARAMETERS
 # lookup_table:             the lookup table to use when determining fitness
@@ -31,9 +34,111 @@
 #                           - "scramble"
 # mutation_probability:     - PyGad mutation probability (default 0.75)
 # log_path:                 - path to the log file (default None)      
-import datetime as dt
+# recorder:                 - a tsprecord.Recorder for each generation's best
+#                             tour (default None)
+# round:                    - the round number recorded with it (default 0)
+# log_generations:          - which generations' best tours are logged and
+#                             recorded, choices are:
+#                           - "all" DEFAULT
+#                           - "improved" (only when the best fitness improves)
+#                           - "off"
+#                           - a number k (every k generations)
+# local_search:             - "2opt", "oropt" or "both" to improve the best
+#                             solution with tsplocal every local_search_every
+#                             generations (default None)
+# local_search_every:       - how often to run the local search (default 0, 
+#                             never)
+# neighbors:                - the neighbor lists for the local search and the
+#                             greedy tours, from tsplocal.neighbor_lists or 
+#                             tsp.create_neighbor_index (default None)
+# initial_population:       - how the population is made when population is
+#                             None, choices are:
+#                           - "seeded" (see create_population) DEFAULT
+#                           - "random" (random permutations)
+#                           - "pygad" (left to PyGAD)
+# progress:                 - a shared array of two ints, set after each 
+#                             generation to the generations completed and the
+#                             generations since the best fitness last improved,
+#                             which the server uses to schedule rounds
+#                             (default None). The GA instance's reset_progress()
+#                             starts the count over.
+# migration:                - a function called with the GA instance after each
+#                             generation, to exchange tours with the other
+#                             stakeholders while the GA runs (default None)
+# engine:                   - "pygad" DEFAULT, or "native" for NativeGA, which
+#                             only supports the "sss", "rank" and "tournament"
+#                             parent selection types and the "inversion" and
+#                             "swap" mutation types, and always starts from a
+#                             seeded or random population
+# timers:                   - a tspstats.Timers which the fitness, selection,
+#                             crossover, mutation and on_generation steps are
+#                             timed in, along with the local search (default 
+#                             None)
+#
+#
+#       GAEngine(lookup_table, distance_table, time_table, **options)
+# A GA that lives through every round, so PyGAD's instance is only built once.
+# Takes the same options as create_tspga (except population and round). The
+# population size never changes: migrants replace the worst solutions, and the
+# population's fitness is kept between runs, so only the migrants' fitness is
+# found again when the GA resumes.
+#
+# METHODS
+# run(round)            - runs the GA until stop_ga is set (or it reaches its
+#                         generation limit), recording its generations under
+#                         round. Returns the number of generations run.
+# inject(migrants)      - merges migrants into the population, see
+#                         merge_migrants
+# new_round()           - starts the progress count over, so the scheduler 
+#                         sees the new round's generations only
+# best(lookup_table = None)
+#                       - returns the best solution, by the GA's own fitness
+#                         or by another lookup table
+#
+#
+#       NativeGA(initial_population, num_generations, fitness_func, 
+#                on_generation = None, num_parents_mating = 2,
+#                parent_selection_type = "sss", crossover_func = None,
+#                keep_parents = 1, mutation_type = "inversion",
+#                mutation_probability = 0.75, tournament_size = 3, rng = None)
+# A GA for permutations, used in place of PyGAD. It has the parts of pygad.GA's
+# interface this project uses (run, best_solution, population, 
+# last_generation_fitness and generations_completed), but skips PyGAD's gene
+# checks: the population is a single 2D array, parents are selected and 
+# offspring mutated all at once with numpy, and the best keep_parents solutions
+# are kept each generation without finding their fitness again. Each offspring
+# is mutated with a chance of mutation_probability, by reversing (inversion) or
+# swapping (swap) two random positions.
+#
+#
+#       create_population(lookup_table, size, neighbors = None, 
+#                         nearest_share = 0.25, greedy_share = 0.05)
+# Returns an initial population made of nearest-neighbor tours (nearest_share
+# of it, from different starting cities), greedy-edge tours (greedy_share) and
+# random permutations (the rest), all built from the given lookup table.
+#
+#       merge_migrants(lookup_table, population, fitness, migrants)
+# Replaces the worst solutions of a population (a 2D array) with the given
+# migrants, in place, skipping any already in it. The fitness of each solution
+# is updated too. Returns the number of migrants merged.
+#
+#       nearest_neighbor_tours(lookup_table, starts, noise = 0, rng = None)
+# Returns a nearest-neighbor tour from each of the starting cities (table
+# indices), built all at once. If noise is more than 0, each cost is multiplied
+# by a random number up to 1 + noise, for more varied tours.
+#
+#       greedy_tour(lookup_table, neighbors = None, noise = 0, rng = None)
+# Returns a greedy-edge tour: the cheapest edges (only to neighbors, if given)
+# are added while no city gets two, and no loop is closed early. The pieces are
+# then joined, each tail to the nearest free head.
+#
+# rng is the numpy random Generator to use (default a new one). NativeGA's
+# default is seeded from the random module, so random.seed repeats its choices.
+from time import perf_counter
 import numpy as np
 import pygad
+import tsprecord
+import tsplocal
 import random
 import tsp
 import log
@@ -47,7 +152,18 @@ def create_tspga(   lookup_table,
                     parents_kept = 5,
                     mutation_type = "inversion", 
                     mutation_probability = 0.75,
-                    log_path = None
+                    log_path = None,
+                    recorder = None,
+                    round = 0,
+                    log_generations = "all",
+                    local_search = None,
+                    local_search_every = 0,
+                    neighbors = None,
+                    initial_population = "seeded",
+                    progress = None,
+                    migration = None,
+                    engine = "pygad",
+                    timers = None
                     ):
 
                     
@@ -59,18 +175,27 @@ def create_tspga(   lookup_table,
     if num_parents_mating < 2:
         num_parents_mating = 2
 
+    # PyGAD can't select more parents than there are solutions
+    if num_parents_mating > POP_SIZE:
+        num_parents_mating = POP_SIZE
+
     if parents_kept > num_parents_mating:
         parents_kept = num_parents_mating
 
-    # returns true if the given list contains duplicates
-    # referenced from:
-    # https://stackoverflow.com/questions/50883576/fastest-way-to-check-if-duplicates-exist-in-a-python-list-numpy-ndarray
-    def contains_duplicates(x):
-        return len(np.unique(x)) != len(x)
+    if population is None and initial_population == "seeded":
+        population = create_population(lookup_table, POP_SIZE, neighbors)
+    elif population is None and (initial_population == "random" or engine == "native"):
+        population = create_population(lookup_table, POP_SIZE, neighbors, 0, 0)
 
-    # determines the fitness of a solution
-    def fitness(solution, solution_idx ):
-        return tsp.fitness(lookup_table, solution)
+    # determines the fitness of a batch of solutions, reusing the fitness
+    # GAEngine kept from the last run when the GA resumes
+    known = [None]
+    def fitness(solutions, solutions_idx):
+        if known[0] is not None:
+            cached = known[0][solutions_idx]
+            known[0] = None
+            return cached
+        return tsp.fitness_batch(lookup_table, solutions)
 
     # CROSSOVER FUNCTION
     # gives better results than crossover_type=None
@@ -78,44 +203,134 @@ def create_tspga(   lookup_table,
     # clones one parent, then picks a second one from the set and swaps one gene
     # as this creates a duplicate gene, continues to swap duplicate genes until 
     # all duplicates have been resolved
+    # each swap puts the second parent's gene in the position where the first 
+    # parent had the duplicate, found with the first parent's inverse 
+    # permutation, so the chain ends once the gene that was swapped out first
+    # comes back in
     def cascade_crossover(parents, offspring_size, ga_instance):
-        offspring = []
+        offspring = np.empty(offspring_size, dtype=parents.dtype)
         N = len(parents) - 1
-        while len(offspring) != offspring_size[0]:
+
+        # positions[p][gene] is the index of gene in parents[p]
+        genes = parents.astype(np.intp)
+        positions = np.empty((len(parents), genes.max() + 1), dtype=np.intp)
+        positions[np.arange(len(parents))[:, None], genes] = np.arange(parents.shape[1])
+
+        for k in range(0, offspring_size[0]):
             p1 = random.randint(0,N) #index of parent 1
             p2 = random.randint(0,N) #index of parent 2
 
             while p2 == p1:
                 p2 = random.randint(0,N)
 
-            child = parents[p1].copy()
+            child = offspring[k]
+            child[:] = parents[p1]
+            parent2 = parents[p2]
+            inverse = positions[p1]
 
             swap_index = random.randint(0,N)
-            child[swap_index] = parents[p2][swap_index]
+            first_gene = child[swap_index]
+            child[swap_index] = parent2[swap_index]
 
             # if the swap creates a duplicate gene,
             # continues to swap genes until all duplicates have been eliminated
-            while (contains_duplicates(child)):
-                swap_index = np.where(parents[p1]==child[swap_index])
-                child[swap_index] = parents[p2][swap_index]
+            while child[swap_index] != first_gene:
+                swap_index = inverse[child[swap_index]]
+                child[swap_index] = parent2[swap_index]
+
+        return offspring
+
+    # how often generations are logged, 0 being never
+    log_generations = str(log_generations)
+    every = 0
+    if log_generations == "all":
+        every = 1
+    elif log_generations not in ["improved", "off"]:
+        every = int(log_generations)
+    best_logged = [0]       # the best fitness logged so far
+    best_seen = [0]         # the best fitness found so far
 
-            offspring.append(child)
-        return np.array(offspring)
+    if progress is not None:
+        progress[0] = progress[1] = 0
+
+    # the next generation is counted as an improvement, starting a new window
+    def reset_progress():
+        best_seen[0] = 0
+        if progress is not None:
+            progress[1] = 0
 
     # logs generation information
+    # the population's fitness was already found by PyGAD, so it's reused here
+    # instead of calling best_solution(), which would find it again
     def on_generation(g):
-        s, fit, _ = g.best_solution()
-        
-        log.write(log_path, "GEN {:02d} - Distance: {:.8} - Time: {:.8}\n{}".format(g.generations_completed, tsp.total(distance_table, s), tsp.total(time_table, s), s), timestamp=True)
+        # polishes the best solution, which the next generation then selects from
+        if local_search is not None and local_search_every > 0 and g.generations_completed % local_search_every == 0:
+            search_start = perf_counter()
+            tsplocal.improve_best(lookup_table, g.population, g.last_generation_fitness, neighbors, local_search)
+            if timers is not None:
+                timers.add("local_search", perf_counter() - search_start)
+
+        if progress is not None:
+            fit = np.max(g.last_generation_fitness)
+            if fit > best_seen[0]:
+                best_seen[0] = fit
+                progress[:] = [g.generations_completed, 0]
+            else:
+                progress[:] = [g.generations_completed, progress[1] + 1]
+
+        if every > 0 or log_generations == "improved":
+            index = np.argmax(g.last_generation_fitness)
+            fit = g.last_generation_fitness[index]
+
+            if (every > 0 and g.generations_completed % every == 0) or (log_generations == "improved" and fit > best_logged[0]):
+                best_logged[0] = max(best_logged[0], fit)
+                s = g.population[index]
+                distance = tsp.total(distance_table, s)
+                time_total = tsp.total(time_table, s)
+
+                # the tour itself is only recorded, not printed
+                log.write(log_path, "GEN {:02d} - Distance: {:.8} - Time: {:.8}".format(g.generations_completed, distance, time_total), timestamp=True)
+                if recorder is not None:
+                    recorder.tour(tsprecord.GENERATION, s, g.round, g.generations_completed, distance, time_total, fit)
+
+        if migration is not None:
+            migration(g)
 
         if stop_ga != None and stop_ga.is_set():
             return "stop"
 
+    if engine == "native":
+        ga_instance = NativeGA(
+            initial_population=population,
+            num_generations=NUM_GENS,
+            fitness_func=fitness,
+            on_generation=on_generation,
+            num_parents_mating=num_parents_mating,
+            parent_selection_type=parent_selection_type,
+            crossover_func=cascade_crossover,
+            keep_parents=parents_kept,
+            mutation_type=mutation_type,
+            mutation_probability=mutation_probability
+        )
+        ga_instance.round = round
+        ga_instance.known_fitness = known
+        ga_instance.reset_progress = reset_progress
+        if timers is not None:
+            ga_instance.fitness_func = timers.wrap("fitness", ga_instance.fitness_func)
+            ga_instance.select = timers.wrap("selection", ga_instance.select)
+            ga_instance.crossover_func = timers.wrap("crossover", ga_instance.crossover_func)
+            ga_instance.mutation = timers.wrap("mutation", ga_instance.mutation)
+            ga_instance.on_generation = timers.wrap("on_generation", ga_instance.on_generation)
+        return ga_instance
+    elif engine != "pygad":
+        raise ValueError("unknown GA engine: {}".format(engine))
+
     ga_instance = pygad.GA(
         initial_population=population,
 
         num_generations=NUM_GENS,                  
         fitness_func=fitness,
+        fitness_batch_size=POP_SIZE,
         on_generation=on_generation,
         sol_per_pop=POP_SIZE,
         num_genes=N,
@@ -131,4 +346,255 @@ def create_tspga(   lookup_table,
         crossover_type=cascade_crossover,
         keep_parents=parents_kept
     )
-    return ga_instance
\ No newline at end of file
+    ga_instance.round = round           # GAEngine changes it every round
+    ga_instance.known_fitness = known
+    ga_instance.reset_progress = reset_progress
+
+    # wrapped after PyGAD has checked how many arguments each one takes
+    if timers is not None:
+        ga_instance.fitness_func = timers.wrap("fitness", ga_instance.fitness_func)
+        ga_instance.select_parents = timers.wrap("selection", ga_instance.select_parents)
+        ga_instance.crossover = timers.wrap("crossover", ga_instance.crossover)
+        ga_instance.mutation = timers.wrap("mutation", ga_instance.mutation)
+        ga_instance.on_generation = timers.wrap("on_generation", ga_instance.on_generation)
+    return ga_instance
+
+# a GA that's paused between rounds instead of being built again
+class GAEngine():
+    def __init__(self, lookup_table, distance_table, time_table, **options):
+        self.lookup_table = lookup_table
+        self.instance = create_tspga(lookup_table, distance_table, time_table, **options)
+        self.fitness = None             # the population's fitness after a run
+
+    def run(self, round = 0):
+        g = self.instance
+        g.round = round
+        if self.fitness is not None:
+            g.known_fitness[0] = self.fitness
+
+        start = g.generations_completed
+        g.run()
+        self.fitness = g.last_generation_fitness
+        return g.generations_completed - start
+
+    def new_round(self):
+        self.instance.reset_progress()
+
+    def inject(self, migrants):
+        if self.fitness is None:
+            self.fitness = tsp.fitness_batch(self.lookup_table, self.instance.population)
+        return merge_migrants(self.lookup_table, self.instance.population, self.fitness, migrants)
+
+    def best(self, lookup_table = None):
+        population = self.instance.population
+        if lookup_table is None:
+            return population[np.argmax(self.fitness)]
+        return tsp.best(population, lookup_table)
+
+# a GA made for permutations, which keeps the population in one 2D array and
+# selects and mutates all of it at once
+class NativeGA():
+    def __init__(self, initial_population, num_generations, fitness_func, on_generation = None,
+                 num_parents_mating = 2, parent_selection_type = "sss", crossover_func = None,
+                 keep_parents = 1, mutation_type = "inversion", mutation_probability = 0.75,
+                 tournament_size = 3, rng = None):
+        if parent_selection_type not in ["sss", "rank", "tournament"]:
+            raise ValueError("the native GA can't use parent_selection_type {}".format(parent_selection_type))
+        if mutation_type not in ["inversion", "swap"]:
+            raise ValueError("the native GA can't use mutation_type {}".format(mutation_type))
+
+        self.population = np.array(initial_population)
+        self.num_generations = num_generations
+        self.fitness_func = fitness_func
+        self.on_generation = on_generation
+        self.num_parents_mating = min(max(num_parents_mating, 2), len(self.population))
+        self.parent_selection_type = parent_selection_type
+        self.crossover_func = crossover_func
+        self.keep_parents = min(keep_parents, len(self.population) - 1)
+        self.mutation_type = mutation_type
+        self.mutation_probability = mutation_probability
+        self.tournament_size = tournament_size
+        self.rng = np.random.default_rng(random.getrandbits(64)) if rng is None else rng
+
+        self.generations_completed = 0
+        self.last_generation_fitness = None
+
+    # returns the indices of the parents, given the population's fitness
+    def select(self, fitness, num_parents):
+        P = len(fitness)
+        if self.parent_selection_type == "sss":
+            return np.argsort(-fitness)[:num_parents]
+        if self.parent_selection_type == "rank":
+            ranks = np.empty(P)
+            ranks[np.argsort(fitness)] = np.arange(1, P+1)
+            return self.rng.choice(P, num_parents, p=ranks/ranks.sum())
+
+        # tournament
+        entrants = self.rng.integers(0, P, size=(num_parents, self.tournament_size))
+        return entrants[np.arange(num_parents), np.argmax(fitness[entrants], axis=1)]
+
+    # mutates some of the offspring in place
+    def mutation(self, offspring):
+        M, N = offspring.shape
+        rows = np.flatnonzero(self.rng.random(M) < self.mutation_probability)
+        if len(rows) == 0 or N < 2:
+            return offspring
+
+        # two different positions per mutated offspring, a < b
+        a = self.rng.integers(0, N-1, size=len(rows))
+        b = self.rng.integers(a+1, N)
+
+        if self.mutation_type == "swap":
+            offspring[rows, a], offspring[rows, b] = offspring[rows, b], offspring[rows, a]
+        else:
+            # reverses a to b, by reading those positions back to front
+            j = np.arange(N)
+            inside = (j >= a[:, None]) & (j <= b[:, None])
+            order = np.where(inside, (a + b)[:, None] - j, j)
+            offspring[rows] = np.take_along_axis(offspring[rows], order, axis=1)
+        return offspring
+
+    def run(self):
+        P, N = self.population.shape
+        self.last_generation_fitness = np.asarray(self.fitness_func(self.population, np.arange(P)), dtype=float)
+
+        for generation in range(0, self.num_generations):
+            fitness = self.last_generation_fitness
+            parents = self.population[self.select(fitness, self.num_parents_mating)]
+            kept = np.argsort(-fitness)[:self.keep_parents]
+
+            offspring = self.crossover_func(parents, (P - len(kept), N), self)
+            self.mutation(offspring)
+
+            # the kept parents' fitness is already known
+            self.population = np.concatenate((self.population[kept], offspring))
+            self.last_generation_fitness = np.concatenate((fitness[kept], self.fitness_func(offspring, np.arange(len(kept), P))))
+            self.generations_completed += 1
+
+            if self.on_generation is not None:
+                r = self.on_generation(self)
+                if type(r) is str and r.lower() == "stop":
+                    break
+
+    # matches pygad.GA.best_solution
+    def best_solution(self, pop_fitness = None):
+        if pop_fitness is None:
+            pop_fitness = self.last_generation_fitness
+        index = np.argmax(pop_fitness)
+        return self.population[index], pop_fitness[index], index
+
+# replaces the worst solutions with migrants that aren't in the population yet
+def merge_migrants(lookup_table, population, fitness, migrants):
+    new = []
+    for migrant in migrants:
+        migrant = np.asarray(migrant, dtype=population.dtype)
+        if not (population == migrant).all(axis=1).any() and not any(np.array_equal(migrant, m) for m in new):
+            new.append(migrant)
+    new = new[:len(population)]
+    if new == []:
+        return 0
+
+    worst = np.argsort(fitness)[:len(new)]
+    population[worst] = new
+    fitness[worst] = tsp.fitness_batch(lookup_table, new)
+    return len(new)
+
+# returns an initial population of nearest-neighbor, greedy and random tours
+def create_population(lookup_table, size, neighbors = None, nearest_share = 0.25, greedy_share = 0.05):
+    N = np.shape(lookup_table)[0]
+    rng = np.random.default_rng(random.getrandbits(64))
+    num_nearest = int(size * nearest_share)
+    num_greedy = int(size * greedy_share)
+
+    parts = []
+    if num_nearest > 0:
+        # tours from different cities, with noise once the cities run out
+        starts = rng.permutation(np.resize(rng.permutation(N), num_nearest))
+        noise = np.where(np.arange(num_nearest) < N, 0, 0.3)[:, None]
+        parts.append(nearest_neighbor_tours(lookup_table, starts, noise, rng))
+
+    for i in range(0, num_greedy):
+        parts.append(greedy_tour(lookup_table, neighbors, 0 if i == 0 else 0.3, rng)[None, :])
+
+    parts.append(rng.permuted(np.tile(np.arange(1, N+1), (size - num_nearest - num_greedy, 1)), axis=1))
+    return np.vstack(parts)
+
+def nearest_neighbor_tours(lookup_table, starts, noise = 0, rng = None):
+    if rng is None:
+        rng = np.random.default_rng()
+    N = np.shape(lookup_table)[0]
+    P = len(starts)
+    rows = np.arange(P)
+
+    tours = np.empty((P, N), dtype=int)
+    visited = np.zeros((P, N), dtype=bool)
+    current = np.asarray(starts)
+    tours[:, 0] = current
+    visited[rows, current] = True
+
+    for k in range(1, N):
+        cost = lookup_table[current]
+        if np.any(noise):
+            cost = cost * (1 + noise * rng.random((P, N)))
+        cost = np.where(visited, np.inf, cost)
+        current = np.argmin(cost, axis=1)
+        tours[:, k] = current
+        visited[rows, current] = True
+
+    return tours + 1
+
+def greedy_tour(lookup_table, neighbors = None, noise = 0, rng = None):
+    if rng is None:
+        rng = np.random.default_rng()
+    N = np.shape(lookup_table)[0]
+
+    # the candidate edges, cheapest first
+    if neighbors is None:
+        start, end = np.nonzero(~np.eye(N, dtype=bool))
+    else:
+        start = np.repeat(np.arange(N), neighbors.shape[1])
+        end = np.asarray(neighbors, dtype=int).ravel()
+    cost = lookup_table[start, end]
+    if noise > 0:
+        cost = cost * (1 + noise * rng.random(len(cost)))
+    order = np.argsort(cost, kind="stable")
+
+    succ = np.full(N, -1)
+    pred = np.full(N, -1)
+    piece = np.arange(N)            # the piece each city is in, as a union-find
+
+    def find(city):
+        while piece[city] != city:
+            piece[city] = piece[piece[city]]
+            city = piece[city]
+        return city
+
+    for e in order:
+        i, j = start[e], end[e]
+        if succ[i] < 0 and pred[j] < 0:
+            a, b = find(i), find(j)
+            if a != b:
+                succ[i] = j
+                pred[j] = i
+                piece[a] = b
+
+    # joins the pieces, from each tail to the nearest head of another piece
+    heads = np.flatnonzero(pred < 0)
+    free = np.ones(N, dtype=bool)
+    free[heads[0]] = False
+    city = heads[0]
+    for k in range(1, len(heads)):
+        while succ[city] >= 0:
+            city = succ[city]
+        candidates = heads[free[heads]]
+        head = candidates[np.argmin(lookup_table[city, candidates])]
+        free[head] = False
+        succ[city] = head
+        city = head
+
+    tour = np.empty(N, dtype=int)
+    city = heads[0]
+    for k in range(0, N):
+        tour[k] = city
+        city = succ[city]
+    return tour + 1
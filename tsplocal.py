@@ -0,0 +1,200 @@
+################################################################################
+# TRAVELING SALESMAN PROBLEM - LOCAL SEARCH
+# Olga Koldachenko          okold525@mtroyal.ca
+# COMP 5690                 Senior Computer Science Project
+# Mount Royal University    Winter 2022
+#
+# 2-opt and Or-opt local search, used by the stakeholders to polish the tours
+# found by the GA. Only moves joining a city to one of its nearest neighbors are
+# tried, and every candidate is scored at once with numpy:
+#   - 2-opt reverses a section of the tour. The lookup tables aren't symmetric
+#     (the normalized tables are divided by column), so the cost of the reversed
+#     section is found from running sums of the tour's forward and backward
+#     edges, which keeps the cost of each move O(1).
+#   - Or-opt moves a section of 1 to 3 cities somewhere else in the tour, next
+#     to a neighbor of one of its ends. Only the 3 edges around each end change.
+# The best move is made, and the candidates are scored again, until no move
+# improves the tour.
+#
+#       neighbor_lists(lookup_table, K = 8)
+# Returns the K nearest cities to each city (as table indices, one row per
+# city), by the cost of travelling between them in both directions.
+#
+#       two_opt(lookup_table, tour, neighbors, max_moves = None)
+# Returns the tour improved by 2-opt, and the number of moves made.
+#
+#       or_opt(lookup_table, tour, neighbors, max_segment = 3, max_moves = None)
+# Returns the tour improved by Or-opt, and the number of moves made.
+#
+#       improve(lookup_table, tour, neighbors, method = "both", max_moves = None)
+# Alternates between 2-opt and Or-opt until neither improves the tour, returning
+# the tour and the number of moves made.
+#
+#       improve_best(lookup_table, population, fitness, neighbors,
+#                    method = "both", max_moves = None)
+# Improves the best solution of a population (a 2D array) in place, given the
+# fitness of each solution, which is updated too. Returns the number of moves.
+#
+#   PARAMETERS
+# lookup_table:     - the table the tour is scored with
+# tour:             - a solution, as a numpy array of cities (from 1)
+# neighbors:        - the result of neighbor_lists
+# method:           - "2opt", "oropt" or "both"
+# fitness:          - the fitness of every solution in the population
+# max_moves:        - the most moves to make (default None, no limit)
+import numpy as np
+import tsp
+
+# moves must improve the tour by more than this, so rounding can't cause loops
+EPSILON = 1e-10
+
+def neighbor_lists(lookup_table, K = 8):
+    N = np.shape(lookup_table)[0]
+    K = max(min(K, N - 1), 0)
+    cost = lookup_table + lookup_table.T
+    np.fill_diagonal(cost, np.inf)
+
+    neighbors = np.argpartition(cost, K - 1, axis=1)[:, :K] if K > 0 else np.empty((N, 0), dtype=np.intp)
+
+    # sorted nearest first
+    order = np.argsort(np.take_along_axis(cost, neighbors, axis=1), axis=1)
+    return np.take_along_axis(neighbors, order, axis=1)
+
+def two_opt(lookup_table, tour, neighbors, max_moves = None):
+    tour = np.array(tour)
+    N = len(tour)
+    moves = 0
+    if N < 4 or neighbors.shape[1] == 0:
+        return tour, moves
+
+    i = np.arange(N)[:, None]
+    position = np.empty(N, dtype=np.intp)
+
+    while max_moves is None or moves < max_moves:
+        t = tour - 1
+        after = np.roll(t, -1)
+        position[t] = i[:, 0]
+
+        # forward[k] is the cost of the edge from position k to k+1, backward[k]
+        # the cost of taking it the other way
+        forward = lookup_table[t, after]
+        backward = lookup_table[after, t]
+        forward_sum = np.concatenate(([0], np.cumsum(forward)))
+        backward_sum = np.concatenate(([0], np.cumsum(backward)))
+
+        # reversing the section between lo+1 and hi joins t[lo] to t[hi] and
+        # t[lo+1] to t[hi+1], so every neighbor gives two moves
+        j = position[neighbors[t]]
+        lo = np.minimum(i, j)
+        hi = np.maximum(i, j)
+        lo = np.concatenate((lo, lo - 1), axis=1)
+        hi = np.concatenate((hi, hi - 1), axis=1)
+        valid = (lo >= 0) & (hi - lo >= 2) & ~((lo == 0) & (hi == N-1))
+        lo = np.where(valid, lo, 0)
+        hi = np.where(valid, hi, 2)
+
+        delta = (lookup_table[t[lo], t[hi]] + lookup_table[after[lo], after[hi]]
+                 - forward[lo] - forward[hi]
+                 + (backward_sum[hi] - backward_sum[lo+1])
+                 - (forward_sum[hi] - forward_sum[lo+1]))
+        delta[~valid] = 0
+
+        k = np.argmin(delta)
+        if delta.flat[k] >= -EPSILON:
+            break
+
+        l, h = lo.flat[k], hi.flat[k]
+        tour[l+1:h+1] = tour[l+1:h+1][::-1]
+        moves += 1
+
+    return tour, moves
+
+def or_opt(lookup_table, tour, neighbors, max_segment = 3, max_moves = None):
+    tour = np.array(tour)
+    N = len(tour)
+    moves = 0
+    if neighbors.shape[1] == 0:
+        return tour, moves
+
+    i = np.arange(N)[:, None]
+    position = np.empty(N, dtype=np.intp)
+
+    while max_moves is None or moves < max_moves:
+        t = tour - 1
+        position[t] = i[:, 0]
+        best = (-EPSILON, None)
+
+        for L in range(1, min(max_segment, N - 3) + 1):
+            # the section is t[i] to t[i+L-1], between p and q
+            first = t
+            last = np.roll(t, -(L-1))
+            p = np.roll(t, 1)
+            q = np.roll(t, -L)
+            removed = lookup_table[p, first] + lookup_table[last, q] - lookup_table[p, q]
+
+            # inserted after a neighbor of the first city, or before a neighbor
+            # of the last one
+            for after in [True, False]:
+                if after:
+                    j = position[neighbors[first]]
+                    a = t[j]
+                    b = t[(j + 1) % N]
+                    offset = (j - i) % N
+                    valid = (offset >= L) & (offset != N-1)
+                else:
+                    j = position[neighbors[last]]
+                    a = t[j - 1]
+                    b = t[j]
+                    offset = (j - i) % N
+                    valid = offset > L
+
+                delta = (lookup_table[a, first[:, None]] + lookup_table[last[:, None], b]
+                         - lookup_table[a, b] - removed[:, None])
+                delta[~valid] = 0
+
+                k = np.argmin(delta)
+                if delta.flat[k] < best[0]:
+                    row, column = np.unravel_index(k, delta.shape)
+                    best = (delta.flat[k], (row, L, offset[row, column], after))
+
+        if best[1] is None:
+            break
+
+        # moves the section to the front, then into its new place
+        row, L, offset, after = best[1]
+        rolled = np.roll(tour, -row)
+        section = rolled[:L]
+        rest = rolled[L:]
+        k = offset - L + 1 if after else offset - L
+        tour = np.concatenate((rest[:k], section, rest[k:]))
+        moves += 1
+
+    return tour, moves
+
+def improve(lookup_table, tour, neighbors, method = "both", max_moves = None):
+    moves = 0
+    while max_moves is None or moves < max_moves:
+        made = 0
+        remaining = None if max_moves is None else max_moves - moves
+        if method in ["2opt", "both"]:
+            tour, m = two_opt(lookup_table, tour, neighbors, remaining)
+            made += m
+        remaining = None if max_moves is None else max_moves - moves - made
+        if method in ["oropt", "both"]:
+            tour, m = or_opt(lookup_table, tour, neighbors, max_moves=remaining)
+            made += m
+        moves += made
+
+        # a single method has already converged
+        if made == 0 or method != "both":
+            break
+
+    return tour, moves
+
+def improve_best(lookup_table, population, fitness, neighbors, method = "both", max_moves = None):
+    index = np.argmax(fitness)
+    tour, moves = improve(lookup_table, population[index], neighbors, method, max_moves)
+    if moves > 0:
+        population[index] = tour
+        fitness[index] = tsp.fitness(lookup_table, tour)
+    return moves
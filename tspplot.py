@@ -0,0 +1,75 @@
+################################################################################
+# TRAVELING SALESMAN PROBLEM - CONVERGENCE SNAPSHOTS
+# Olga Koldachenko          okold525@mtroyal.ca
+# COMP 5690                 Senior Computer Science Project
+# Mount Royal University    Winter 2022
+#
+# Plots the best solution of every round while the search runs, in a process of
+# its own so the server never waits on matplotlib, then animates the plots into
+# a GIF of how the search converged. Each round is saved with tsp.render_solution
+# to Round-001.png, Round-002.png, ... in the snapshot directory.
+#
+#       Snapshots(problem, directory)
+# Starts the process plotting the snapshots of a problem (a DataFrame) into
+# directory. Solutions are plotted as they're put on its queue, which is passed
+# to the server (see Committee.queue_snapshot), as tuples of
+# (round, solution, name), name being the plot's title.
+#
+# METHODS
+# close()             - waits for every snapshot to be plotted, returning their
+#                       paths in order
+#
+#
+#       render_snapshots(problem, queue, directory)
+# THIS FUNCTION SHOULD NOT BE CALLED ON ITS OWN, but is rather run in the
+# process started by Snapshots. Plots each (round, solution, name) taken from
+# the queue, until it gets None.
+#
+#       snapshot_path(directory, round)
+# Returns the path a round's snapshot is saved to.
+#
+#       animate(frames, save_path, seconds_per_frame = 0.5)
+# Saves the images at the given paths as an animated GIF, shown once each in
+# order, with the last one held for longer. Returns save_path, or None if there
+# were no frames.
+from multiprocessing import Process, Queue
+from PIL import Image
+import tsp
+import os
+
+class Snapshots():
+    def __init__(self, problem, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.queue = Queue()
+        self.process = Process(target=render_snapshots, args=[problem, self.queue, directory], daemon=True)
+        self.process.start()
+
+    # the rounds are found from the files, since the server queues them itself
+    def close(self):
+        self.queue.put(None)
+        self.process.join()
+        frames = sorted(f for f in os.listdir(self.directory) if f.startswith("Round-") and f.endswith(".png"))
+        return [os.path.join(self.directory, f) for f in frames]
+
+def snapshot_path(directory, round):
+    return os.path.join(directory, "Round-{:03d}.png".format(round))
+
+def render_snapshots(problem, queue, directory):
+    while True:
+        snapshot = queue.get()
+        if snapshot is None:
+            break
+        round, solution, name = snapshot
+        tsp.render_solution(problem, solution, snapshot_path(directory, round), name)
+
+def animate(frames, save_path, seconds_per_frame = 0.5):
+    if len(frames) == 0:
+        return None
+
+    # palette images keep the GIF, and the memory it takes, small
+    images = [Image.open(f).convert("P", palette=Image.ADAPTIVE) for f in frames]
+    durations = [int(seconds_per_frame * 1000)] * len(images)
+    durations[-1] *= 4
+    images[0].save(save_path, save_all=True, append_images=images[1:], duration=durations, loop=0)
+    return save_path
@@ -0,0 +1,217 @@
+################################################################################
+# TRAVELING SALESMAN PROBLEM - RUN RECORDING
+# Olga Koldachenko          okold525@mtroyal.ca
+# COMP 5690                 Senior Computer Science Project
+# Mount Royal University    Winter 2022
+#
+# Records the tours found during a run in an append-only binary file, next to
+# the text logs (Name.txt is recorded in Name.rec), so they can be analyzed
+# with pandas instead of parsing printed arrays. Each record is a fixed header
+# followed by a tour, with cities stored as uint16 (or uint32 for problems over
+# 65535 cities):
+#
+#   kind        - GENERATION (the best tour of a generation), POPULATION (a tour
+#                 sent by the server), RESULT (a tour sent to the server), TOP
+#                 (a top solution picked by the server) or NAME
+#   stakeholder - which stakeholder the record belongs to, named by the NAME
+#                 record with the same number
+#   round       - the round the tour was found or sent in
+#   generation  - the GA generation, or the tour's index in a POPULATION or TOP
+#   timestamp   - seconds since the epoch
+#   distance, time, fitness
+#               - the tour's totals, and its fitness to whoever recorded it
+#
+# Records are buffered, and written with a single append, so a client and its
+# worker process can share a file.
+#
+#       Recorder(path)
+# Writes records to a file. Use get(path) instead, which shares one Recorder per
+# file in each process.
+#
+# METHODS
+# create()            - empties the file
+# name(stakeholder, name)
+#                     - records the name of a stakeholder number
+# tour(kind, tour, round = 0, generation = 0, distance = nan,
+#      time_total = nan, fitness = nan, stakeholder = 0)
+#                     - records a tour
+# tours(kind, tours, round = 0, distances = None, times = None,
+#       fitnesses = None, stakeholder = 0)
+#                     - records a list of tours, numbering them from 0
+# flush()             - writes out the buffered records
+#
+#
+#       path_for(log_path)
+# Returns the recording path for a text log path, or None if it's None.
+#
+#       get(path)
+# Returns this process's Recorder for a path, or None if the path is None.
+#
+#       load(path)
+# Returns the records in a file as a pandas DataFrame, with one row per record
+# (NAME records are turned into the name column), and the tours in the tour
+# column as numpy arrays.
+#
+#       load_dir(log_dir)
+# Returns the records of every file in a log directory as a single DataFrame,
+# with the file's name in the file column.
+#
+#       tours(frame)
+# Returns the tours of a DataFrame returned by load as a single 2D array.
+from multiprocessing import util
+from threading import Lock
+import pandas as pd
+import numpy as np
+import struct
+import atexit
+import time
+import os
+
+GENERATION = 1
+POPULATION = 2
+RESULT = 3
+TOP = 4
+NAME = 5
+
+KINDS = {GENERATION: "generation", POPULATION: "population", RESULT: "result", TOP: "top"}
+
+WIDE = 1                        # flag set when cities are stored as uint32
+
+# kind, flags, stakeholder, round, generation, timestamp, distance, time,
+# fitness, and the number of cities (or bytes, for a NAME) that follow
+RECORD = struct.Struct("<BBHIIddddI")
+
+# records are written once this many bytes are buffered
+BUFFER_SIZE = 1 << 16
+
+class Recorder():
+    def __init__(self, path):
+        self.path = path
+        self.pid = os.getpid()
+        self.buffer = []
+        self.size = 0
+        self.lock = Lock()      # a client and its worker thread share it
+
+    def create(self):
+        with self.lock:
+            self.buffer = []
+            self.size = 0
+            open(self.path, "wb").close()
+
+    def append(self, header, payload):
+        with self.lock:
+            self.buffer.append(header)
+            self.buffer.append(payload)
+            self.size += len(header) + len(payload)
+            full = self.size >= BUFFER_SIZE
+        if full:
+            self.flush()
+
+    def name(self, stakeholder, name):
+        payload = name.encode()
+        self.append(RECORD.pack(NAME, 0, stakeholder, 0, 0, time.time(), np.nan, np.nan, np.nan, len(payload)), payload)
+
+    def tour(self, kind, tour, round = 0, generation = 0, distance = np.nan, time_total = np.nan, fitness = np.nan, stakeholder = 0):
+        tour = np.asarray(tour)
+        flags = 0
+        dtype = "<u2"
+        if len(tour) > np.iinfo(np.uint16).max:
+            flags |= WIDE
+            dtype = "<u4"
+        self.append(RECORD.pack(kind, flags, stakeholder, round, generation, time.time(), distance, time_total, fitness, len(tour)), tour.astype(dtype).tobytes())
+
+    def tours(self, kind, tours, round = 0, distances = None, times = None, fitnesses = None, stakeholder = 0):
+        for i in range(0, len(tours)):
+            self.tour(kind, tours[i], round, i,
+                      np.nan if distances is None else distances[i],
+                      np.nan if times is None else times[i],
+                      np.nan if fitnesses is None else fitnesses[i],
+                      stakeholder)
+
+    def flush(self):
+        with self.lock:
+            if self.size == 0:
+                return
+            data = b"".join(self.buffer)
+            self.buffer = []
+            self.size = 0
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+        except OSError:
+            print("Fail to write recording:", self.path)
+
+# this process's recorders, by path
+recorders = {}
+
+def flush_all():
+    for recorder in recorders.values():
+        if recorder.pid == os.getpid():
+            recorder.flush()
+
+def path_for(log_path):
+    if log_path is None:
+        return None
+    return os.path.splitext(log_path)[0] + ".rec"
+
+# a forked process gets copies of its parent's recorders, which are replaced so
+# the parent's buffered records aren't written twice
+def get(path):
+    if path is None:
+        return None
+    if path not in recorders or recorders[path].pid != os.getpid():
+        if not any(r.pid == os.getpid() for r in recorders.values()):
+            atexit.register(flush_all)
+
+            # multiprocessing children don't run atexit, but do run these
+            util.Finalize(None, flush_all, exitpriority=100)
+        recorders[path] = Recorder(path)
+    return recorders[path]
+
+def load(path):
+    with open(path, "rb") as f:
+        data = f.read()
+
+    names = {}
+    rows = []
+    offset = 0
+    while offset + RECORD.size <= len(data):
+        kind, flags, stakeholder, round, generation, timestamp, distance, time_total, fitness, length = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+
+        if kind == NAME:
+            names[stakeholder] = data[offset:offset+length].decode()
+            offset += length
+            continue
+
+        dtype = np.dtype("<u4") if flags & WIDE else np.dtype("<u2")
+        if offset + length * dtype.itemsize > len(data):
+            break       # cut off while being written
+        tour = np.frombuffer(data, dtype=dtype, count=length, offset=offset).astype(np.int64)
+        offset += length * dtype.itemsize
+
+        rows.append((KINDS.get(kind, kind), stakeholder, round, generation, timestamp, distance, time_total, fitness, tour))
+
+    frame = pd.DataFrame(rows, columns=["kind", "stakeholder", "round", "generation", "timestamp", "distance", "time", "fitness", "tour"])
+    frame.insert(2, "name", frame["stakeholder"].map(names))
+    frame["timestamp"] = pd.to_datetime(frame["timestamp"], unit="s")
+    return frame
+
+def load_dir(log_dir):
+    frames = []
+    for file in sorted(os.listdir(log_dir)):
+        if file.endswith(".rec"):
+            frame = load(os.path.join(log_dir, file))
+            frame.insert(0, "file", os.path.splitext(file)[0])
+            frames.append(frame)
+    if frames == []:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
+
+def tours(frame):
+    if len(frame) == 0:
+        return np.empty((0, 0), dtype=np.int64)
+    return np.vstack(frame["tour"].to_list())
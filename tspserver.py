@@ -4,39 +4,132 @@
 # COMP 5690                 Senior Computer Science Project
 # Mount Royal University    Winter 2022
 #
-#       Stakeholder(conn, name, distance_table, time_table)
+#       Stakeholder(conn, name, distance_table, time_table, binary = False)
 # An object containing the information for a single stakeholder. THIS SHOULD NOT
-# BE USED ON ITS OWN, but rather created by the Committee class.
+# BE USED ON ITS OWN, but rather created by the Committee class. If binary is
+# True, tours are exchanged with it as tspwire frames.
 #
 # METHODS
-# try_recv() - returns True if the stakeholder has sent a message, and updates
-#              the stakeholder's last_result.
+# try_recv(reference = None) 
+#            - returns True if the stakeholder has sent a message, and updates
+#              the stakeholder's last_result. If the connection was closed,
+#              connected is set to False. reference is the tour that binary
+#              results are delta encoded against. A "status" message updates
+#              the stakeholder's progress instead, and a "stats" message is
+#              added to its stats (the phase summary of its round, see 
+#              tspstats.py), both returning False.
+# add_stats(summary)
+#            - adds a tspstats summary to the stakeholder's stats
+# try_send(message, binary = False)
+#            - sends a message (bytes, if binary is True) if the stakeholder
+#              is still connected, returning whether it was sent. If the
+#              connection was closed, connected is set to False.
+# update_status(generations, stagnation)
+#            - records the progress of the stakeholder's GA
+# reset_status()
+#            - forgets it, for a new round
+# improved() - returns whether the GA improved since the status before
 #
 #
-#       Committee(distance_table, time_table)
-# An object containing the set of all Stakeholder objects.
+#       Committee(distance_table, time_table, archive_size = 10)
+# An object containing the set of all Stakeholder objects. The time spent in
+# its send_to_all, send_solutions, recv_from_all and find_top_solutions is
+# added up in timers, a tspstats.Timers. The best solutions of every round are
+# kept in archive, an EliteArchive of archive_size.
 #
 # METHODS
-# add(conn, name)                       - creates a new Stakeholder object.
-# send_to_all(data)                     - sends data to all Stakeholder objects.
+# add(conn, name, binary = False)       - creates a new Stakeholder object.
+# send_to_all(data)                     - sends data to all connected 
+#                                         Stakeholder objects, returning those
+#                                         it reached.
+# send_solutions(solutions)             - sends the "continue" message with the
+#                                         given solutions to all connected 
+#                                         Stakeholders.
 # recv_from_all()                       - receives solutions from all 
-#                                         Stakeholder objects.
+#                                         connected Stakeholder objects, 
+#                                         blocking until each has answered or 
+#                                         disconnected.
+# recv_status(timeout)                  - asks all Stakeholders for their GA's
+#                                         progress, waiting at most timeout 
+#                                         seconds for the answers.
+# recv_migrants(archive, lookup_table, timeout)
+#                                       - receives the solutions Stakeholders 
+#                                         send on their own for timeout 
+#                                         seconds, adding them to an 
+#                                         EliteArchive.
+# send_migrants(archive, N)             - sends each Stakeholder the best N
+#                                         solutions in the archive found by 
+#                                         others.
 # close_all()                           - closes all connections to Stakeholders
-# find_top_solutions(lookup_table, N)   - returns the top N solutions
-# get_best_solution(lookup_table)       - returns the best solution
+# find_top_solutions(lookup_table, N)   - returns the top N unique solutions
+#                                         of the round, adding them to the 
+#                                         archive. Rotations of a tour are the
+#                                         same solution.
+# get_best_solution(lookup_table)       - returns the best solution of every
+#                                         round, and the name of whoever found
+#                                         it
 # print_all()                           - prints all Stakeholder results.
 # print_top(best=False)                 - prints the last best solutions found, 
-#                                         or the best.
+#                                         or the best of every round.
 # csv_header()                          - returns the header for the CSV file, 
 #                                         as a list of strings
 # csv_solutions(round, lookup_table)    - returns all fitness values as a list 
-#                                         of strings.
+#                                         of strings, each followed by the 
+#                                         stakeholder's generations and phase 
+#                                         times for the round, then the 
+#                                         server's (which are reset).
+# record_names(recorder)               - records the stakeholders' names in a
+#                                         tsprecord.Recorder, numbered by their
+#                                         CSV columns.
+# record_round(recorder, round, lookup_table)
+#                                       - records every result and the top 
+#                                         solutions of a round.
+# queue_snapshot(queue, round, lookup_table)
+#                                       - puts the round's best solution on a
+#                                         tspplot.Snapshots queue.
+#
+#
+#       EliteArchive(size = 10)
+# The best size unique solutions sent to the server, best first. Rotations of a
+# tour are the same solution.
+#
+# METHODS
+# add(solution, fitness, name = None)   - adds a solution found by the named 
+#                                         stakeholder, returning True if it 
+#                                         made it in
+# best(N, exclude = None)               - returns the best N solutions, leaving
+#                                         out those found by exclude
+#
+#
+#       RoundScheduler(wait_time, num_rounds, stagnation_generations = 50,
+#                      min_wait = 1, max_wait = None, time_budget = None,
+#                      poll_interval = 1)
+# Decides when rounds end, by asking the stakeholders for their GA's progress
+# with "req_status" every poll_interval seconds. After min_wait seconds, a round
+# ends early once every stakeholder has gone stagnation_generations generations
+# without improving. Past wait_time, it's only extended while some stakeholder
+# is still improving, up to max_wait seconds (default 2 * wait_time). If
+# time_budget is given, rounds are shortened to fit num_rounds into it, leaving
+# min_wait for each remaining round, and the search stops when it runs out.
+# Stakeholders that don't report their progress get wait_time.
+#
+# METHODS
+# begin_round(i, stakeholders)      - starts timing round i (from 0)
+# round_over(stakeholders)          - returns why the round should end, or None
+# wait(committee)                   - polls the committee until the round ends,
+#                                     returning why
+# out_of_time()                     - whether the time budget is used up
 #
 #
 #       server_func(problem, num_clients, wait_time=5, num_rounds = 5, 
 #                   pipe = None, distance_weight = 0.5, time_weight = 0.5, 
 #                   address = ("localhost", 6000), num_top_solutions = 3, 
-#                   log_dir = None)
+#                   log_dir = None, shared_tables = False, binary_tours = True,
+#                   authkey = None, neighbors = 16, adaptive_rounds = False,
+#                   stagnation_generations = 50, min_wait = 1,
+#                   max_wait = None, time_budget = None, migration = False,
+#                   migration_interval = 1, archive_size = 10,
+#                   snapshots = None)
 # The function to be passed to a Process object as the target.
 #
 #   PARAMETERS
@@ -47,138 +140,469 @@
 # pipe:            - a Connection object to send the best solution to main
 # distance_weight: - the weight to apply to fitness using distance (default 0.5)
 # time_weight:     - the weight to apply to fitness using time (default 0.5)
-# address:         - the server's address (default ("localhost", 6000))
+# address:         - the server's address (default ("localhost", 6000)), use
+#                    ("0.0.0.0", port) to accept stakeholders from any host
 # num_top_solutions- the number of top solutions to keep track of (default 3)
-# log_dir:         - the directory to save the log files (default None)
+# log_dir:         - the directory to save the log files (default None), the
+#                    results are also recorded in Server.rec (see tsprecord.py)
+# shared_tables:   - if True, the lookup tables are sent to the clients through
+#                    shared memory instead of being copied (default False)
+# binary_tours:    - whether to accept clients asking to exchange tours with
+#                    the tspwire format (default True)
+# authkey:         - bytes that clients must know to connect (default None)
+# neighbors:       - how many nearest cities to send for each city in the 
+#                    "init" message, for the clients' local search (default 16)
+# adaptive_rounds: - if True, rounds are timed by a RoundScheduler instead of
+#                    always lasting wait_time (default False)
+# stagnation_generations, min_wait, max_wait, time_budget
+#                  - passed to the RoundScheduler
+# migration:       - if True, the GAs aren't stopped between rounds. Instead,
+#                    each stakeholder sends its best solution whenever it 
+#                    changes (at most every migration_interval seconds), and 
+#                    every migration_interval seconds the server sends each
+#                    stakeholder the best num_top_solutions solutions found by
+#                    the others, from the committee's archive. Rounds only
+#                    record the last solution from each (default False)
+# archive_size:    - how many of the best solutions of the search are kept, the
+#                    best of which is the one reported at the end (default 10)
+# snapshots:       - a queue the best solution of each round is put on, to be
+#                    plotted while the search runs (see tspplot.Snapshots)
+#                    (default None)
 from datetime import datetime
 from multiprocessing import Process
-from multiprocessing.connection import Listener
+from multiprocessing.connection import Listener, wait
+from multiprocessing import AuthenticationError
 import numpy as np
+import heapq
+import pickle
 import time
+import tsprecord
+import tspshared
+import tspstats
+import tspwire
 import log
 import os
 import tsp
 
 # holds data for a single client
 class Stakeholder():
-    def __init__(self, conn, name, distance_table, time_table):
+    def __init__(self, conn, name, distance_table, time_table, binary = False):
         self.name = name
         self.conn = conn
+        self.binary = binary
         self.last_result = None
+        self.connected = True
         self.distance_table = distance_table
         self.time_table = time_table
-
-    def try_recv(self):
+        self.generations = None         # the GA's progress, from "req_status"
+        self.stagnation = None
+        self.last_generations = None    # generations at the status before
+        self.status_received = False
+        self.stats = None               # the last round's tspstats summary
+
+    # a "status" reply updates the progress instead of the result
+    def try_recv(self, reference = None):
         try:
             if self.conn.poll():
-                self.last_result = self.conn.recv()
+                if self.binary:
+                    data = self.conn.recv_bytes()
+                    if tspwire.is_frame(data):
+                        self.last_result = tspwire.decode(data, reference)[0]
+                        return True
+                    message = pickle.loads(data)
+                else:
+                    message = self.conn.recv()
+
+                if isinstance(message, tuple) and message[0] == "status":
+                    self.update_status(message[1], message[2])
+                    return False
+                if isinstance(message, tuple) and message[0] == "stats":
+                    self.add_stats(message[1])
+                    return False
+                if isinstance(message, tuple) and message[0] == "migrant":
+                    message = message[1]
+                self.last_result = message
                 return True
         except EOFError:
-            pass
+            self.connected = False
 
         return False
 
+    # migrating stakeholders send several summaries a round, which are summed
+    def add_stats(self, summary):
+        if self.stats is None:
+            self.stats = summary
+        else:
+            timers = tspstats.Timers()
+            timers.merge(self.stats)
+            timers.merge(summary)
+            self.stats = timers.summary()
+
+    # a closed connection only shows up as an error on the next send
+    def try_send(self, message, binary = False):
+        if not self.connected:
+            return False
+        try:
+            if binary:
+                self.conn.send_bytes(message)
+            else:
+                self.conn.send(message)
+            return True
+        except OSError:
+            print(datetime.now(), self.name, "disconnected.")
+            self.connected = False
+            return False
+
+    def update_status(self, generations, stagnation):
+        self.last_generations = self.generations
+        self.generations = generations
+        self.stagnation = stagnation
+        self.status_received = True
+
+    # forgets the progress of the last round's GA
+    def reset_status(self):
+        self.generations = self.stagnation = self.last_generations = None
+
+    # whether the GA improved since the status before
+    def improved(self):
+        if self.last_generations is None or self.generations < self.last_generations:
+            return True
+        return self.stagnation < self.generations - self.last_generations
+
     def __str__(self):
-        s = "{} {:>29} D: {:.2f} T: {:.2f} {}".format(datetime.now(), 
-                                            self.name, 
-                                            tsp.total(self.distance_table, self.last_result), 
-                                            tsp.total(self.time_table, self.last_result), 
-                                            self.last_result)
-        return s
+        return solution_string(self.name, self.last_result, self.distance_table, self.time_table)
+
+# returns a line describing a solution, for printing
+def solution_string(name, solution, distance_table, time_table):
+    return "{} {:>29} D: {:.2f} T: {:.2f} {}".format(datetime.now(), 
+                                            name, 
+                                            tsp.total(distance_table, solution), 
+                                            tsp.total(time_table, solution), 
+                                            solution)
+
+# returns the same bytes for every rotation of a tour, so they can be hashed.
+# reversals are kept apart, since the time table isn't symmetric
+def tour_key(solution):
+    return tsp.tour_cache.tour_key(solution, symmetric=False)
 
 # a collection of stakeholders
 class Committee():
-    def __init__(self, distance_table, time_table):
+    def __init__(self, distance_table, time_table, archive_size = 10):
         self.stakeholder_list = []
         self.max_name_length = 0
         self.top = []
+        self.csv_stakeholders = []
+        self.reference = None           # the last best solution sent out
         self.distance_table = distance_table
         self.time_table = time_table
+        self.timers = tspstats.Timers()  # the time spent in each phase
+        self.archive = EliteArchive(archive_size)   # the best of every round
 
     # adds a stakeholder to the committee
-    def add(self, conn, name):
-        self.stakeholder_list.append(Stakeholder(conn, name, self.distance_table, self.time_table))
+    def add(self, conn, name, binary = False):
+        self.stakeholder_list.append(Stakeholder(conn, name, self.distance_table, self.time_table, binary))
         self.max_name_length = max(self.max_name_length, len(name))
 
     # sends the same message to all clients
+    # returns the stakeholders who were sent it
     def send_to_all(self, message):
-        for s in self.stakeholder_list:
-            s.conn.send(message)
+        with self.timers.time("send_to_all"):
+            return [s for s in self.stakeholder_list if s.try_send(message)]
+
+    # sends the solutions for the next round to all clients
+    # the tour frame is only built once, and only if someone asked for it
+    def send_solutions(self, solutions):
+        frame = None
+        with self.timers.time("send_solutions"):
+            for s in self.stakeholder_list:
+                if not s.connected:
+                    continue
+                if s.binary:
+                    if frame is None:
+                        frame = tspwire.encode(solutions, self.reference)
+                    s.try_send(frame, binary=True)
+                else:
+                    s.try_send(("continue", solutions))
+
+        if len(solutions) > 0:
+            self.reference = solutions[0]
 
     # requests data from all clients, then waits to receive it 
     def recv_from_all(self):
-        self.send_to_all("req_result")
-
-        waiting_list = []
+        with self.timers.time("recv_from_all"):
+            for stakeholder in self.stakeholder_list:
+                stakeholder.stats = None
+            waiting = {}
+            for stakeholder in self.send_to_all("req_result"):
+                waiting[stakeholder.conn] = stakeholder
+
+            # sleeps until at least one stakeholder has something to read
+            while waiting != {}:
+                for conn in wait(list(waiting)):
+                    stakeholder = waiting[conn]
+                    if stakeholder.try_recv(self.reference):  # if you successfully get data
+                        del waiting[conn]
+                    elif not stakeholder.connected:
+                        print(datetime.now(), stakeholder.name, "disconnected.")
+                        del waiting[conn]
+
+    # asks all clients for their GA's progress, waiting at most timeout seconds
+    def recv_status(self, timeout):
+        waiting = {}
         for stakeholder in self.stakeholder_list:
-            waiting_list.append(stakeholder)
-
-        while waiting_list != []:
-            for stakeholder in waiting_list:
-                if stakeholder.try_recv():  # if you successfully get data
-                    waiting_list.remove(stakeholder)
+            stakeholder.status_received = False
+            if stakeholder.try_send("req_status"):
+                waiting[stakeholder.conn] = stakeholder
+
+        deadline = time.monotonic() + timeout
+        while waiting != {}:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            for conn in wait(list(waiting), remaining):
+                stakeholder = waiting[conn]
+                stakeholder.try_recv(self.reference)
+                if stakeholder.status_received or not stakeholder.connected:
+                    del waiting[conn]
+
+    # receives the migrants pushed by the clients for timeout seconds, adding
+    # each to the archive
+    def recv_migrants(self, archive, lookup_table, timeout):
+        received = 0
+        deadline = time.monotonic() + timeout
+        while True:
+            conns = [s.conn for s in self.stakeholder_list if s.connected]
+            remaining = deadline - time.monotonic()
+            if conns == [] or remaining <= 0:
+                break
+            for conn in wait(conns, remaining):
+                stakeholder = next(s for s in self.stakeholder_list if s.conn is conn)
+                if stakeholder.try_recv(self.reference):
+                    archive.add(stakeholder.last_result, tsp.fitness(lookup_table, stakeholder.last_result), stakeholder.name)
+                    received += 1
+                elif not stakeholder.connected:
+                    print(datetime.now(), stakeholder.name, "disconnected.")
+        return received
+
+    # sends each client the best N solutions in the archive found by others
+    def send_migrants(self, archive, N):
+        for s in self.stakeholder_list:
+            migrants = archive.best(N, exclude=s.name)
+            if migrants != []:
+                s.try_send(("migrants", migrants))
 
     # closes all connections
     def close_all(self):
         for s in self.stakeholder_list:
             s.conn.close()
 
-    # returns a numpy array containing the best solution using the given lookup table
+    # returns the best solution of every round so far, and who found it
     def get_best_solution(self, lookup_table):
-        if self.top == []:
+        if self.archive.entries == []:
             self.find_top_solutions(lookup_table)
-        
-        return self.top[0]
+
+        fitness, tour, name = self.archive.entries[0]
+        return tour, name
 
     # returns the top N unique solutions, default 3
     # DOES NOT RETURN THE STAKEHOLDERS THEMSELVES
+    # the costs are totalled at once, and rotations of a tour count as one
+    # (kept for the first stakeholder to send it). ties go to the earlier
+    # stakeholder, and every unique solution is offered to the archive
     def find_top_solutions(self, lookup_table, N = 3):
-        top = []
-        for stakeholder in self.stakeholder_list:
+        with self.timers.time("find_top_solutions"):
+            candidates = [s for s in self.stakeholder_list if s.last_result is not None]
+            if candidates == []:
+                self.top = []
+                return []
+
+            costs = tsp.total_batch(lookup_table, np.array([s.last_result for s in candidates]))
+            unique = {}
+            for i in range(0, len(candidates)):
+                key = tour_key(candidates[i].last_result)
+                if key not in unique:
+                    unique[key] = (costs[i], i)
+
+            top = heapq.nsmallest(N, unique.values())
+            for cost, i in unique.values():
+                self.archive.add(candidates[i].last_result, 1 / cost, candidates[i].name)
+
+            self.top = [candidates[i] for cost, i in top]
+            return [s.last_result for s in self.top]
+
+    # queues the round's best solution to be plotted
+    def queue_snapshot(self, queue, round, table):
+        if self.top != []:
+            best = self.top[0]
+            queue.put((round, best.last_result, "Round {} | {} | D: {:.2f} | T: {:.2f} | F: {:.2f}".format(round, best.name, tsp.total(self.distance_table, best.last_result), tsp.total(self.time_table, best.last_result), tsp.fitness(table, best.last_result))))
 
-            no_duplicates = True
-            for i in range(0,len(top)):
-                if np.array2string(stakeholder.last_result) == np.array2string(top[i].last_result):
-                    no_duplicates = False
-
-            if no_duplicates:
-                if len(top) < N:
-                    top.append(stakeholder)
-                else:
-                    if tsp.total(lookup_table, stakeholder.last_result) < tsp.total(lookup_table, top[N-1].last_result):
-                        top.remove(top[N-1])
-                        top.append(stakeholder)
-            top.sort(key=lambda x: tsp.total(lookup_table, x.last_result))
-        self.top = top    
-        return list(map(lambda x: x.last_result, top)) 
-    
     # prints all solutions
     def print_all(self):
         for s in self.stakeholder_list:
-            print(s)
+            if s.last_result is not None:
+                print(s)
 
-    # prints the top solution
+    # prints the top solutions of the round, or the best of every round
     def print_top(self, best=False):
         if best:
-            print(self.top[0])
+            fitness, tour, name = self.archive.entries[0]
+            print(solution_string(name, tour, self.distance_table, self.time_table))
         else:
             for s in self.top:
                 print(s)
 
+    # the columns are fixed to the stakeholders present when this is called
     def csv_header(self):
+        self.csv_stakeholders = list(self.stakeholder_list)
         header = ["Round", "Time", "Best Solution Stakeholder", "Best Solution Fitness"]
-        for s in self.stakeholder_list:
+        for s in self.csv_stakeholders:
             header.append(s.name)
+            header.append("{} generations".format(s.name))
+            header += ["{} {}".format(s.name, phase) for phase in tspstats.STAKEHOLDER_PHASES]
+        header += ["Server {}".format(phase) for phase in tspstats.SERVER_PHASES]
         return header
 
+    # numbers the stakeholders in the recording by their CSV columns
+    def record_names(self, recorder):
+        for i in range(0, len(self.csv_stakeholders)):
+            recorder.name(i, self.csv_stakeholders[i].name)
+
+    # records every result and the top solutions of a round
+    def record_round(self, recorder, round, table):
+        for i in range(0, len(self.csv_stakeholders)):
+            sol = self.csv_stakeholders[i].last_result
+            if sol is not None:
+                recorder.tour(tsprecord.RESULT, sol, round, 0, tsp.total(self.distance_table, sol), tsp.total(self.time_table, sol), tsp.fitness(table, sol), i)
+
+        # each top solution is recorded under the stakeholder who found it
+        for i in range(0, len(self.top)):
+            sol = self.top[i].last_result
+            stakeholder = self.csv_stakeholders.index(self.top[i]) if self.top[i] in self.csv_stakeholders else len(self.csv_stakeholders)
+            recorder.tour(tsprecord.TOP, sol, round, i, tsp.total(self.distance_table, sol), tsp.total(self.time_table, sol), tsp.fitness(table, sol), stakeholder)
+        recorder.flush()
+
     def csv_solutions(self, round, table):
         arr = [str(round), str(datetime.now())]
         arr.append(self.top[0].name)
         arr.append(str(tsp.fitness(table, self.top[0].last_result)))
-        for s in self.stakeholder_list:
-            arr.append(str(tsp.fitness(table, s.last_result)))
+        for s in self.csv_stakeholders:
+            if s.last_result is None:
+                arr.append("")
+            else:
+                arr.append(str(tsp.fitness(table, s.last_result)))
+
+            # each stakeholder's time in each phase of the round, if it sent it
+            if s.stats is None:
+                arr.append("")
+            else:
+                arr.append(str(s.stats.get("on_generation", [0, 0])[1]))
+            arr += tspstats.csv_seconds(s.stats, tspstats.STAKEHOLDER_PHASES)
+        arr += tspstats.csv_seconds(self.timers.summary(), tspstats.SERVER_PHASES)
         return arr
 
+# the best unique solutions found so far, best first
+class EliteArchive():
+    def __init__(self, size = 10):
+        self.size = size
+        self.entries = []           # (fitness, tour, name)
+        self.keys = set()
+
+    # returns True if the solution made it into the archive
+    def add(self, solution, fitness, name = None):
+        key = tour_key(solution)
+        if key in self.keys:
+            return False
+        if len(self.entries) == self.size and fitness <= self.entries[-1][0]:
+            return False
+
+        i = 0
+        while i < len(self.entries) and self.entries[i][0] >= fitness:
+            i += 1
+        self.entries.insert(i, (fitness, np.array(solution), name))
+        self.keys.add(key)
+
+        if len(self.entries) > self.size:
+            self.keys.discard(tour_key(self.entries.pop()[1]))
+        return True
+
+    # returns the best N solutions, leaving out the ones found by exclude
+    def best(self, N, exclude = None):
+        return [tour for fitness, tour, name in self.entries if name is None or name != exclude][:N]
+
+# decides when each round ends, from the stakeholders' progress
+class RoundScheduler():
+    def __init__(self, wait_time, num_rounds, stagnation_generations = 50, min_wait = 1, max_wait = None, time_budget = None, poll_interval = 1):
+        self.wait_time = wait_time
+        self.num_rounds = num_rounds
+        self.stagnation_generations = stagnation_generations
+        self.min_wait = min_wait
+        self.max_wait = 2 * wait_time if max_wait is None else max_wait
+        self.time_budget = time_budget
+        self.poll_interval = poll_interval
+        self.round_start = time.monotonic()
+        self.round_length = self.max_wait
+        self.start = self.round_start       # when the search began
+
+    # the seconds of the time budget left, or None if there isn't one
+    def remaining(self):
+        if self.time_budget is None:
+            return None
+        return self.time_budget - (time.monotonic() - self.start)
+
+    # whether there's no time left for another round
+    def out_of_time(self):
+        remaining = self.remaining()
+        return remaining is not None and remaining < self.min_wait
+
+    def begin_round(self, i, stakeholders):
+        self.round_start = time.monotonic()
+        self.round_length = self.max_wait
+
+        # leaves at least min_wait for every round after this one
+        remaining = self.remaining()
+        if remaining is not None:
+            self.round_length = min(self.round_length, remaining - (self.num_rounds - i - 1) * self.min_wait)
+            self.round_length = max(self.round_length, self.min_wait)
+
+        for s in stakeholders:
+            s.reset_status()
+
+    def elapsed(self):
+        return time.monotonic() - self.round_start
+
+    # returns why the round should end now, or None to keep going
+    def round_over(self, stakeholders):
+        elapsed = self.elapsed()
+        if elapsed >= self.round_length:
+            return "out of time"
+        if elapsed < self.min_wait:
+            return None
+
+        reporting = [s for s in stakeholders if s.connected and s.stagnation is not None]
+        if reporting == []:
+            # clients that can't report their progress get the usual wait_time
+            if elapsed >= self.wait_time:
+                return "wait time over"
+            return None
+
+        if all(s.stagnation >= self.stagnation_generations for s in reporting):
+            return "all stagnant"
+
+        # past wait_time, the round is only extended while someone improves
+        if elapsed >= self.wait_time and not any(s.improved() for s in reporting):
+            return "no more improvements"
+        return None
+
+    # waits until the round should end, polling the committee's progress
+    def wait(self, committee):
+        while True:
+            time.sleep(max(min(self.poll_interval, self.round_length - self.elapsed()), 0))
+            if self.elapsed() < self.round_length:
+                committee.recv_status(self.poll_interval)
+            reason = self.round_over(committee.stakeholder_list)
+            if reason is not None:
+                return reason
+
 def server_func(problem,
                 num_clients, 
                 wait_time=5,
@@ -188,47 +612,120 @@ def server_func(problem,
                 time_weight = 0.5, 
                 address = ("localhost", 6000),
                 num_top_solutions = 3,
-                log_dir = None):
+                log_dir = None,
+                shared_tables = False,
+                binary_tours = True,
+                authkey = None,
+                neighbors = 16,
+                adaptive_rounds = False,
+                stagnation_generations = 50,
+                min_wait = 1,
+                max_wait = None,
+                time_budget = None,
+                migration = False,
+                migration_interval = 1,
+                archive_size = 10,
+                snapshots = None):
 
     csv_path = os.path.join(log_dir, "Server.csv")
     csv = log.CSVLogFile(csv_path)
+    recorder = tsprecord.get(os.path.join(log_dir, "Server.rec"))
+    recorder.create()
 
     distance_table, time_table, distance_norm, time_norm = tsp.create_lookup_tables(problem)
     chair_weights = tsp.create_weighted_table(distance_weight, time_weight, distance_norm, time_norm)
+    neighbor_index = tsp.create_neighbor_index(problem, neighbors)
+
+    # publishes the tables once, and uses the shared copies from here on
+    shared = None
+    if shared_tables:
+        shared = tspshared.SharedTables([distance_norm, time_norm, distance_table, time_table, chair_weights, neighbor_index])
+        distance_norm, time_norm, distance_table, time_table, chair_weights, neighbor_index = shared.tables
 
     start_time = datetime.now()
-    listener = Listener(address)
-    c = Committee(distance_table, time_table)
+    # the backlog lets every stakeholder queue up while others authenticate
+    listener = Listener(address, backlog=max(num_clients, 1), authkey=authkey)
+    c = Committee(distance_table, time_table, archive_size)
+    print(datetime.now(), "Waiting for", num_clients, "stakeholders on", address)
 
     try:
-        # connects to all clients
-        for i in range(0, num_clients):
-            conn = listener.accept()
-            name = conn.recv()
-            c.add(conn, name)
+        # connects to all clients, from any host
+        while len(c.stakeholder_list) < num_clients:
+            try:
+                conn = listener.accept()
+            except AuthenticationError:
+                print(datetime.now(), "Rejected a stakeholder with the wrong authkey from", listener.last_accepted)
+                continue
+
+            name, binary, reply = tspwire.negotiate(conn.recv(), binary_tours)
+            if reply is not None:
+                conn.send(reply)
+            c.add(conn, name, binary)
+            print(datetime.now(), "Registered", name, "from", listener.last_accepted)
     except:
         listener.close()
 
     csv.write(c.csv_header())
+    c.record_names(recorder)
+
+    scheduler = None
+    if adaptive_rounds and not migration:
+        scheduler = RoundScheduler(wait_time, num_rounds, stagnation_generations, min_wait, max_wait, time_budget)
+
+    # with migration, the GAs run through the whole search, and the rounds are
+    # only when the results are recorded
+    archive = None
+    if migration:
+        archive = c.archive
+        c.send_to_all(("migrate", migration_interval))
 
     # rounds
     top_solutions = []
 
     for i in range(0, num_rounds):
+        if i > 0 and scheduler is not None and scheduler.out_of_time():
+            print()
+            print(datetime.now(), "Out of time, ending after", i, "rounds.")
+            break
+
         print()
         print(datetime.now(), "BEGINNING ROUND", i+1)
+        round_start = time.time()
+        round_cpu_time = time.process_time()
+        if scheduler is not None:
+            scheduler.begin_round(i, c.stakeholder_list)
 
         # sends command/data to all clients
         if i == 0:
-            c.send_to_all(("init", distance_norm, time_norm, distance_table, time_table, chair_weights))
+            init_message = ("init", distance_norm, time_norm, distance_table, time_table, chair_weights, neighbor_index)
+            if shared is not None:
+                init_message = ("init", shared.handle)
+            c.send_to_all(init_message)
+        elif archive is None:
+            c.send_solutions(top_solutions)
+
+        wait_start = time.perf_counter()
+        if archive is not None:
+            # passes migrants around until the end of the round
+            received = 0
+            for s in c.stakeholder_list:
+                s.stats = None
+            round_end = time.monotonic() + wait_time
+            while time.monotonic() < round_end:
+                received += c.recv_migrants(archive, chair_weights, min(migration_interval, round_end - time.monotonic()))
+                c.send_migrants(archive, num_top_solutions)
+            print(datetime.now(), "Received {} migrants, the archive holds {}.".format(received, len(archive.entries)))
+        elif scheduler is None:
+            time.sleep(wait_time)
         else:
-            c.send_to_all(("continue", top_solutions))
-
-        time.sleep(wait_time)
-
-        # receives data from all clients
-        print(datetime.now(), "Receiving results...")
-        c.recv_from_all()
+            reason = scheduler.wait(c)
+            print(datetime.now(), "Ending round {} after {:.2f} seconds ({}).".format(i+1, scheduler.elapsed(), reason))
+        c.timers.add("wait", time.perf_counter() - wait_start)
+
+        # receives data from all clients, or uses the last migrant of each
+        if archive is None:
+            print(datetime.now(), "Receiving results...")
+            c.recv_from_all()
         c.print_all()
 
         # records and prints the top solutions
@@ -239,6 +736,11 @@ def server_func(problem,
             print(datetime.now(), "Top solutions for round", i+1)
             c.print_top()
         csv.write(c.csv_solutions(i+1, chair_weights))
+        c.record_round(recorder, i+1, chair_weights)
+        if snapshots is not None:
+            c.queue_snapshot(snapshots, i+1, chair_weights)
+
+        print(datetime.now(), "Server CPU time for round {}: {:.4f} of {:.2f} seconds".format(i+1, time.process_time() - round_cpu_time, time.time() - round_start))
     
     # sends stop command to all clients
     c.send_to_all(("stop"))
@@ -252,11 +754,15 @@ def server_func(problem,
 
     total_time = (datetime.now() - start_time).total_seconds()
     print(datetime.now(), "Total Time: {} seconds (expected {})".format(total_time, num_rounds * wait_time))
+    print(datetime.now(), tsp.tour_cache.stats())
 
     # sends the best solution for drawing
     if pipe != None:
-        stakeholder = c.get_best_solution(chair_weights)
-        pipe.send((stakeholder.last_result, "{} | D: {:.2f} | T: {:.2f} | F: {:.2f}".format(stakeholder.name, tsp.total(distance_table, stakeholder.last_result), tsp.total(time_table, stakeholder.last_result), tsp.fitness(chair_weights, stakeholder.last_result))))
+        solution, name = c.get_best_solution(chair_weights)
+        pipe.send((solution, "{} | D: {:.2f} | T: {:.2f} | F: {:.2f}".format(name, tsp.total(distance_table, solution), tsp.total(time_table, solution), tsp.fitness(chair_weights, solution))))
         pipe.close()
 
-    c.close_all()
\ No newline at end of file
+    c.close_all()
+
+    if shared is not None:
+        shared.close()
\ No newline at end of file
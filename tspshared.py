@@ -0,0 +1,91 @@
+################################################################################
+# TRAVELING SALESMAN PROBLEM - SHARED LOOKUP TABLES
+# Olga Koldachenko          okold525@mtroyal.ca
+# COMP 5690                 Senior Computer Science Project
+# Mount Royal University    Winter 2022
+#
+# Lets the server publish its lookup tables once, in a single shared memory
+# block, instead of pickling a copy of every table for every client. Only a
+# small handle is sent in the "init" message, and clients attach to the tables
+# without copying them.
+#
+#       SharedTables(tables)
+# Copies the given list of numpy arrays into a new shared memory block. Owned by
+# the server, which must call close() when the search is done.
+#
+# ATTRIBUTES
+# tables     - the list of arrays, as views into the shared memory block
+# handle     - a SharedTablesHandle to send to the clients
+#
+# METHODS
+# close()    - removes the shared memory block, so it's freed once every
+#              process using it has exited
+#
+#
+#       SharedTablesHandle(name, layout)
+# A picklable reference to a SharedTables block.
+#
+# METHODS
+# attach()   - returns the list of tables as read-only views into the block.
+#              The block stays mapped until the process exits.
+from multiprocessing import shared_memory
+import numpy as np
+
+# the start of each table is aligned to this many bytes
+ALIGNMENT = 64
+
+# every block opened by this process, by name
+# numpy views don't keep a block mapped, so the blocks are kept here instead,
+# otherwise closing one would pull the memory out from under its tables
+blocks = {}
+
+# opens an existing shared memory block without handing it to the resource
+# tracker, which would otherwise remove it when the attaching process exits
+def open_block(name):
+    if name not in blocks:
+        try:
+            blocks[name] = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:   # track was added in python 3.13
+            from multiprocessing import resource_tracker
+            block = shared_memory.SharedMemory(name=name)
+            resource_tracker.unregister(block._name, "shared_memory")
+            blocks[name] = block
+    return blocks[name]
+
+# returns views into a block, given (shape, dtype, offset) for each table
+def views(block, layout, writeable):
+    tables = []
+    for shape, dtype, offset in layout:
+        table = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf, offset=offset)
+        table.flags.writeable = writeable
+        tables.append(table)
+    return tables
+
+class SharedTablesHandle():
+    def __init__(self, name, layout):
+        self.name = name
+        self.layout = layout
+
+    def attach(self):
+        return views(open_block(self.name), self.layout, False)
+
+class SharedTables():
+    def __init__(self, tables):
+        layout = []
+        size = 0
+        for table in tables:
+            size = -(-size // ALIGNMENT) * ALIGNMENT
+            layout.append((table.shape, table.dtype.str, size))
+            size += table.nbytes
+
+        self.block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        blocks[self.block.name] = self.block
+        self.tables = views(self.block, layout, True)
+        for shared, table in zip(self.tables, tables):
+            shared[...] = table
+            shared.flags.writeable = False
+
+        self.handle = SharedTablesHandle(self.block.name, layout)
+
+    def close(self):
+        self.block.unlink()
@@ -0,0 +1,118 @@
+################################################################################
+# TRAVELING SALESMAN PROBLEM - INSTRUMENTATION
+# Olga Koldachenko          okold525@mtroyal.ca
+# COMP 5690                 Senior Computer Science Project
+# Mount Royal University    Winter 2022
+#
+# Counts and times the phases of the search, so it's clear where each round's
+# wait_time goes. Timing a phase only costs two clock reads and a dictionary
+# update, so it's always on. Each stakeholder sends the server a summary of its
+# phases every round (see tsp_client), which the server writes to Server.csv.
+#
+#       Timers()
+# Totals the seconds spent in, and the number of calls to, named phases. Each
+# thread or process keeps its own, and passes summaries on.
+#
+# METHODS
+# add(name, seconds, count = 1) - adds to a phase
+# time(name)                    - returns a context manager which times a phase
+# wrap(name, func)              - returns func, timing every call to it
+# merge(summary)                - adds the phases of another summary
+# summary(reset = True)         - returns a dict mapping each phase to a list of
+#                                 its seconds and calls, starting over if reset
+#
+#
+#       profile_path(log_path)
+# Returns the path the cProfile stats of a stakeholder are saved to (Name.txt
+# is profiled in Name.prof), or None if log_path is None. The stats can be read
+# with pstats, or python -m pstats Name.prof.
+#
+#       csv_seconds(summary, phases)
+# Returns the seconds of the given phases of a summary as CSV columns, or empty
+# columns if summary is None.
+#
+#
+# STAKEHOLDER_PHASES are the phases written to Server.csv for each stakeholder:
+#   generations   - the number of generations run (the calls to on_generation)
+#   ga            - running the GA
+#   fitness, selection, crossover, mutation
+#                 - the GA's steps
+#   on_generation - the per-generation hook (logging, progress, local search
+#                   and migration)
+#   local_search  - the local search, during and after the GA
+#   worker_wait   - the worker waiting for commands while the GA is stopped
+#   client_wait   - the client waiting for messages from the server
+#   dispatch      - the client handling the server's commands
+#   ipc           - the worker sending its result to the client
+#
+# SERVER_PHASES are the server's own, also in Server.csv:
+#   send_to_all, send_solutions, recv_from_all, find_top_solutions
+#                 - the Committee methods
+#   wait          - the server waiting for the round to end
+from time import perf_counter
+import os
+
+STAKEHOLDER_PHASES = ["ga", "fitness", "selection", "crossover", "mutation", "on_generation",
+                      "local_search", "worker_wait", "client_wait", "dispatch", "ipc"]
+
+SERVER_PHASES = ["send_to_all", "send_solutions", "recv_from_all", "find_top_solutions", "wait"]
+
+# times a single phase, from a with statement
+class Timer():
+    __slots__ = ["timers", "name", "start"]
+
+    def __init__(self, timers, name):
+        self.timers = timers
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timers.add(self.name, perf_counter() - self.start)
+        return False
+
+class Timers():
+    def __init__(self):
+        self.phases = {}
+
+    def add(self, name, seconds, count = 1):
+        phase = self.phases.get(name)
+        if phase is None:
+            self.phases[name] = [seconds, count]
+        else:
+            phase[0] += seconds
+            phase[1] += count
+
+    def time(self, name):
+        return Timer(self, name)
+
+    def wrap(self, name, func):
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(name, perf_counter() - start)
+        return timed
+
+    def merge(self, summary):
+        for name, (seconds, count) in summary.items():
+            self.add(name, seconds, count)
+
+    def summary(self, reset = True):
+        summary = {name: list(phase) for name, phase in self.phases.items()}
+        if reset:
+            self.phases = {}
+        return summary
+
+def profile_path(log_path):
+    if log_path is None:
+        return None
+    return os.path.splitext(log_path)[0] + ".prof"
+
+def csv_seconds(summary, phases):
+    if summary is None:
+        return [""] * len(phases)
+    return ["{:.4f}".format(summary[p][0]) if p in summary else "0" for p in phases]
@@ -0,0 +1,122 @@
+################################################################################
+# TRAVELING SALESMAN PROBLEM - BINARY TOUR PROTOCOL
+# Olga Koldachenko          okold525@mtroyal.ca
+# COMP 5690                 Senior Computer Science Project
+# Mount Royal University    Winter 2022
+#
+# A compact format for sending tours between the server and clients, instead of
+# pickling numpy int64 arrays. A frame is a fixed header followed by the tours,
+# with cities stored as uint16 (or uint32 for problems over 65535 cities).
+# Given a reference tour (the previous round's best, known to both ends), each
+# tour is stored as only the positions where it differs from the reference,
+# whenever that is smaller.
+#
+# A client asks for the format by sending (name, [BINARY]) instead of its name
+# when it connects. The server answers with ("wire", BINARY) if it accepts, or
+# ("wire", PICKLE) if it doesn't. Clients that only send their name are always
+# sent pickles.
+#
+#       encode(tours, reference = None)
+# Returns a list of tours as a frame (bytes).
+#
+#       decode(data, reference = None)
+# Returns the list of tours in a frame, as int64 numpy arrays.
+#
+#       is_frame(data)
+# Returns True if the given bytes are a tour frame.
+#
+#       negotiate(hello, allow_binary = True)
+# Used by the server on the first message from a client. Returns the client's
+# name, whether to use tour frames with it, and the reply to send (None for
+# clients that didn't ask).
+import numpy as np
+import struct
+
+BINARY = "binary"
+PICKLE = "pickle"
+
+MAGIC = b"TOUR"
+VERSION = 1
+WIDE = 1                        # flag set when cities are stored as uint32
+
+# magic, version, flags, number of tours, tour length
+HEADER = struct.Struct("<4sBBII")
+CHANGES = struct.Struct("<I")
+
+FULL = b"\x00"
+DELTA = b"\x01"
+
+def is_frame(data):
+    return data[:len(MAGIC)] == MAGIC
+
+def negotiate(hello, allow_binary = True):
+    if not isinstance(hello, tuple):
+        return hello, False, None
+
+    name, offered = hello
+    binary = allow_binary and BINARY in offered
+    return name, binary, ("wire", BINARY if binary else PICKLE)
+
+def encode(tours, reference = None):
+    tours = [np.asarray(tour) for tour in tours]
+    length = 0 if tours == [] else len(tours[0])
+
+    flags = 0
+    dtype = np.dtype("<u2")
+    if length > np.iinfo(np.uint16).max:
+        flags |= WIDE
+        dtype = np.dtype("<u4")
+
+    if reference is not None and len(reference) != length:
+        reference = None
+
+    parts = [HEADER.pack(MAGIC, VERSION, flags, len(tours), length)]
+    for tour in tours:
+        if reference is not None:
+            positions = np.flatnonzero(tour != reference)
+
+            # a delta costs a position and a city for every change
+            if 2 * len(positions) < length:
+                parts.append(DELTA)
+                parts.append(CHANGES.pack(len(positions)))
+                parts.append(positions.astype(dtype).tobytes())
+                parts.append(tour[positions].astype(dtype).tobytes())
+                continue
+
+        parts.append(FULL)
+        parts.append(tour.astype(dtype).tobytes())
+
+    return b"".join(parts)
+
+def decode(data, reference = None):
+    magic, version, flags, count, length = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("not a version {} tour frame".format(VERSION))
+
+    dtype = np.dtype("<u4") if flags & WIDE else np.dtype("<u2")
+    offset = HEADER.size
+
+    tours = []
+    for i in range(0, count):
+        mode = data[offset:offset+1]
+        offset += 1
+
+        if mode == FULL:
+            tour = np.frombuffer(data, dtype=dtype, count=length, offset=offset).astype(np.int64)
+            offset += length * dtype.itemsize
+        else:
+            if reference is None:
+                raise ValueError("a delta encoded tour needs a reference tour")
+            changes, = CHANGES.unpack_from(data, offset)
+            offset += CHANGES.size
+            positions = np.frombuffer(data, dtype=dtype, count=changes, offset=offset)
+            offset += changes * dtype.itemsize
+            cities = np.frombuffer(data, dtype=dtype, count=changes, offset=offset)
+            offset += changes * dtype.itemsize
+
+            tour = np.array(reference, dtype=np.int64)
+            tour[positions] = cities
+
+        tours.append(tour)
+
+    return tours